@@ -1,27 +1,99 @@
 import cv2
 import numpy
 import math
+import time
 from enum import Enum
 
+class ColorSegmenter:
+    """
+    Segments a BGR image against GRIP red/green/blue ranges with one inRange
+    on the BGR channels, instead of converting the frame to RGB first.
+    """
+
+    def __init__(self):
+        self.__key = None
+        self.__lower = None
+        self.__upper = None
+        self.__output = None
+
+    @staticmethod
+    def __bounds(red, green, blue):
+        """Turns GRIP ranges into inRange bounds.
+        Args:
+            red: A list of two numbers the are the min and max red.
+            green: A list of two numbers the are the min and max green.
+            blue: A list of two numbers the are the min and max blue.
+        Returns:
+            (lower, upper) tuples of integers in BGR order.
+        """
+        lower = []
+        upper = []
+        for low, high in (blue, green, red):
+            # cv2.inRange rounds fractional bounds to the nearest integer
+            low = max(int(round(low)), 0)
+            high = min(int(round(high)), 255)
+            if low > high:
+                # An empty range matches nothing
+                low, high = 255, 0
+            lower.append(low)
+            upper.append(high)
+        return tuple(lower), tuple(upper)
+
+    def threshold(self, input, red, green, blue):
+        """Segment an image based on color ranges.
+        Args:
+            input: A BGR numpy.ndarray.
+            red: A list of two numbers the are the min and max red.
+            green: A list of two numbers the are the min and max green.
+            blue: A list of two numbers the are the min and max blue.
+        Returns:
+            A black and white numpy.ndarray.
+        """
+        key = (tuple(red), tuple(green), tuple(blue))
+        if key != self.__key:
+            self.__lower, self.__upper = self.__bounds(red, green, blue)
+            self.__key = key
+        if self.__output is None or self.__output.shape != input.shape[:2]:
+            self.__output = numpy.empty(input.shape[:2], dtype=numpy.uint8)
+        return cv2.inRange(input, self.__lower, self.__upper, dst=self.__output)
+
+
 class VisionPipeline:
     """
     An OpenCV pipeline generated by GRIP.
     """
     
-    def __init__(self):
+    def __init__(self, resize_first=False, backend="contours"):
         """initializes all values to presets or None if need to be set
+        Args:
+            resize_first: If true, shrink the color frame (area interpolation)
+                before thresholding instead of resizing the binary mask.
+                Faster, but not equivalent: it finds fewer targets (about 80%
+                against 92% on the synthetic sweep).
+            backend: "contours" traces every blob with findContours,
+                "components" labels blobs with connectedComponentsWithStats and
+                only traces the ones that can pass the filter.
         """
 
+        self.resize_first = resize_first
+        self.backend = backend
+        # Optional object with lap(name, start) -> now, called after every step
+        self.stage_timer = None
+
         self.__rgb_threshold_red = [0.0, 144.92648866498453]
         self.__rgb_threshold_green = [145.14312278990366, 255.0]
         self.__rgb_threshold_blue = [0.0, 144.49355199942204]
 
+        self.__color_segmenter = ColorSegmenter()
+
         self.rgb_threshold_output = None
 
         self.__resize_image_input = self.rgb_threshold_output
         self.__resize_image_width = 320.0
         self.__resize_image_height = 240.0
-        self.__resize_image_interpolation = cv2.INTER_CUBIC
+        # GRIP says CUBIC, but the generated call passed it as fy, so the mask
+        # has always been resized bilinearly; that is what the filter is tuned for
+        self.__resize_image_interpolation = cv2.INTER_LINEAR
 
         self.resize_image_output = None
 
@@ -50,33 +122,97 @@ class VisionPipeline:
         self.filter_contours_output = None
 
 
-    def process(self, source0):
+    def process(self, source0, roi=None):
         """
         Runs the pipeline and sets all outputs to new values.
+        Args:
+            roi: Optional (x, y, width, height) window in resized image
+                coordinates. Only that window is processed, and contours are
+                still reported in resized image coordinates.
         """
-        # Step RGB_Threshold0:
-        self.__rgb_threshold_input = source0
-        (self.rgb_threshold_output) = self.__rgb_threshold(self.__rgb_threshold_input, self.__rgb_threshold_red, self.__rgb_threshold_green, self.__rgb_threshold_blue)
+        timer = self.stage_timer
+        if timer:
+            t = time.perf_counter()
 
-        # Step Resize_Image0:
-        self.__resize_image_input = self.rgb_threshold_output
-        (self.resize_image_output) = self.__resize_image(self.__resize_image_input, self.__resize_image_width, self.__resize_image_height, self.__resize_image_interpolation)
+        width = self.__resize_image_width
+        height = self.__resize_image_height
+        offset = (0, 0)
+        if roi is not None:
+            x, y, w, h = roi
+            scale_x = source0.shape[1] / self.__resize_image_width
+            scale_y = source0.shape[0] / self.__resize_image_height
+            source0 = source0[int(y * scale_y):int((y + h) * scale_y), int(x * scale_x):int((x + w) * scale_x)]
+            width, height = w, h
+            offset = (int(x), int(y))
+
+        if self.resize_first:
+            # Step Resize_Image0 (color frame, a quarter of the pixels to threshold):
+            self.__resize_image_input = source0
+            (self.resize_image_output) = self.__resize_image(self.__resize_image_input, width, height, cv2.INTER_AREA)
+            if timer:
+                t = timer.lap("pipeline.resize", t)
+
+            # Step RGB_Threshold0:
+            self.__rgb_threshold_input = self.resize_image_output
+            (self.rgb_threshold_output) = self.__rgb_threshold(self.__rgb_threshold_input, self.__rgb_threshold_red, self.__rgb_threshold_green, self.__rgb_threshold_blue)
+            if timer:
+                t = timer.lap("pipeline.threshold", t)
+
+            self.__find_contours_input = self.rgb_threshold_output
+        else:
+            # Step RGB_Threshold0:
+            self.__rgb_threshold_input = source0
+            (self.rgb_threshold_output) = self.__rgb_threshold(self.__rgb_threshold_input, self.__rgb_threshold_red, self.__rgb_threshold_green, self.__rgb_threshold_blue)
+            if timer:
+                t = timer.lap("pipeline.threshold", t)
+
+            # Step Resize_Image0:
+            self.__resize_image_input = self.rgb_threshold_output
+            (self.resize_image_output) = self.__resize_image(self.__resize_image_input, width, height, self.__resize_image_interpolation)
+            if timer:
+                t = timer.lap("pipeline.resize", t)
+
+            self.__find_contours_input = self.resize_image_output
 
         # Step Find_Contours0:
-        self.__find_contours_input = self.resize_image_output
-        (self.find_contours_output) = self.__find_contours(self.__find_contours_input, self.__find_contours_external_only)
+        if self.backend == "components":
+            (self.find_contours_output) = self.__find_blob_contours(self.__find_contours_input, self.__filter_contours_min_area, self.__filter_contours_min_width, self.__filter_contours_max_width, self.__filter_contours_min_height, self.__filter_contours_max_height, self.__filter_contours_min_ratio, self.__filter_contours_max_ratio, offset)
+        else:
+            (self.find_contours_output) = self.__find_contours(self.__find_contours_input, self.__find_contours_external_only, offset)
+        if timer:
+            t = timer.lap("pipeline.find_contours", t)
 
         # Step Convex_Hulls0:
         self.__convex_hulls_contours = self.find_contours_output
         (self.convex_hulls_output) = self.__convex_hulls(self.__convex_hulls_contours)
+        if timer:
+            t = timer.lap("pipeline.hulls", t)
 
         # Step Filter_Contours0:
         self.__filter_contours_contours = self.convex_hulls_output
         (self.filter_contours_output) = self.__filter_contours(self.__filter_contours_contours, self.__filter_contours_min_area, self.__filter_contours_min_perimeter, self.__filter_contours_min_width, self.__filter_contours_max_width, self.__filter_contours_min_height, self.__filter_contours_max_height, self.__filter_contours_solidity, self.__filter_contours_max_vertices, self.__filter_contours_min_vertices, self.__filter_contours_min_ratio, self.__filter_contours_max_ratio)
+        if timer:
+            t = timer.lap("pipeline.filter", t)
 
 
-    @staticmethod
-    def __rgb_threshold(input, red, green, blue):
+    def set_resize(self, width, height):
+        """Changes the size the frame is resized to before finding contours.
+        The filter's pixel limits are rescaled so the same targets still pass.
+        Args:
+            width: The new width in pixels.
+            height: The new height in pixels.
+        """
+        scale = width / self.__resize_image_width
+        self.__resize_image_width = float(width)
+        self.__resize_image_height = float(height)
+        self.__filter_contours_min_area *= scale * scale
+        self.__filter_contours_min_perimeter *= scale
+        self.__filter_contours_min_width *= scale
+        self.__filter_contours_max_width *= scale
+        self.__filter_contours_min_height *= scale
+        self.__filter_contours_max_height *= scale
+
+    def __rgb_threshold(self, input, red, green, blue):
         """Segment an image based on color ranges.
         Args:
             input: A BGR numpy.ndarray.
@@ -86,8 +222,7 @@ class VisionPipeline:
         Returns:
             A black and white numpy.ndarray.
         """
-        out = cv2.cvtColor(input, cv2.COLOR_BGR2RGB)
-        return cv2.inRange(out, (red[0], green[0], blue[0]),  (red[1], green[1], blue[1]))
+        return self.__color_segmenter.threshold(input, red, green, blue)
 
     @staticmethod
     def __resize_image(input, width, height, interpolation):
@@ -100,14 +235,15 @@ class VisionPipeline:
         Returns:
             A numpy.ndarray of the new size.
         """
-        return cv2.resize(input, ((int)(width), (int)(height)), 0, 0, interpolation)
+        return cv2.resize(input, ((int)(width), (int)(height)), interpolation=interpolation)
 
     @staticmethod
-    def __find_contours(input, external_only):
+    def __find_contours(input, external_only, offset=(0, 0)):
         """Sets the values of pixels in a binary image to their distance to the nearest black pixel.
         Args:
             input: A numpy.ndarray.
             external_only: A boolean. If true only external contours are found.
+            offset: An (x, y) shift added to every contour point.
         Return:
             A list of numpy.ndarray where each one represents a contour.
         """
@@ -116,9 +252,77 @@ class VisionPipeline:
         else:
             mode = cv2.RETR_LIST
         method = cv2.CHAIN_APPROX_SIMPLE
-        im2, contours, hierarchy =cv2.findContours(input, mode=mode, method=method)
+        im2, contours, hierarchy =cv2.findContours(input, mode=mode, method=method, offset=offset)
         return contours
 
+    @staticmethod
+    def __find_blob_contours(input, min_area, min_width, max_width, min_height, max_height,
+                             min_ratio, max_ratio, offset=(0, 0)):
+        """Finds the external contours of the blobs that can pass the contour filter.
+        Args:
+            input: A numpy.ndarray.
+            min_area: The minimum area of a contour that will be kept.
+            min_width: Minimum width of a contour.
+            max_width: MaxWidth maximum width.
+            min_height: Minimum height.
+            max_height: Maximimum height.
+            min_ratio: Minimum ratio of width to height.
+            max_ratio: Maximum ratio of width to height.
+            offset: An (x, y) shift added to every contour point.
+        Return:
+            A list of numpy.ndarray where each one represents a contour.
+        """
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(input, connectivity=8)
+        x = stats[1:, cv2.CC_STAT_LEFT]
+        y = stats[1:, cv2.CC_STAT_TOP]
+        w = stats[1:, cv2.CC_STAT_WIDTH]
+        h = stats[1:, cv2.CC_STAT_HEIGHT]
+        # The bounding box of a blob is the bounding box of its contour (and
+        # hull), and w * h bounds the hull area from above, so this never drops
+        # a blob the exact filter would keep.
+        ratio = w / h.astype(float)
+        keep = ((w >= min_width) & (w <= max_width)
+                & (h >= min_height) & (h <= max_height)
+                & (w * h >= min_area)
+                & (ratio >= min_ratio) & (ratio <= max_ratio))
+        kept = numpy.flatnonzero(keep)
+        # Only a blob whose box contains another's can enclose it
+        around = ((x[None, :] <= x[kept, None]) & (y[None, :] <= y[kept, None])
+                  & (x[None, :] + w[None, :] >= (x + w)[kept, None])
+                  & (y[None, :] + h[None, :] >= (y + h)[kept, None]))
+        around[numpy.arange(len(kept)), kept] = False
+        output = []
+        for k, i in enumerate(kept):
+            blob = (labels[y[i]:y[i] + h[i], x[i]:x[i] + w[i]] == i + 1).astype(numpy.uint8)
+            # RETR_EXTERNAL never reports a blob sitting in another blob's hole
+            if around[k].any() and VisionPipeline.__in_hole(labels, x, y, w, h, i, numpy.flatnonzero(around[k]), int(numpy.argmax(blob[:, 0]))):
+                continue
+            contours = cv2.findContours(blob, mode=cv2.RETR_EXTERNAL, method=cv2.CHAIN_APPROX_SIMPLE, offset=(int(x[i]) + offset[0], int(y[i]) + offset[1]))[-2]
+            output.extend(contours)
+        return output
+
+    @staticmethod
+    def __in_hole(labels, x, y, w, h, i, around, row):
+        """Whether blob i lies in a hole of another blob.
+        Args:
+            labels: Labels from connectedComponentsWithStats.
+            x, y, w, h: Bounding boxes of the blobs, background excluded.
+            i: The blob to check.
+            around: The other blobs whose boxes contain blob i's.
+            row: A row, relative to its box, where blob i touches its left edge.
+        Return:
+            True if findContours with RETR_EXTERNAL would leave blob i out.
+        """
+        for j in around:
+            # Blob j alone, with a free border so everything outside it connects
+            mask = numpy.zeros((h[j] + 2, w[j] + 2), dtype=numpy.uint8)
+            mask[1:-1, 1:-1] = labels[y[j]:y[j] + h[j], x[j]:x[j] + w[j]] == j + 1
+            cv2.floodFill(mask, None, (0, 0), 2, flags=4)
+            # Pixels still 0 are in j's holes
+            if mask[y[i] - y[j] + row + 1, x[i] - x[j] + 1] == 0:
+                return True
+        return False
+
     @staticmethod
     def __convex_hulls(input_contours):
         """Computes the convex hulls of contours.
@@ -153,29 +357,29 @@ class VisionPipeline:
         Returns:
             Contours as a list of numpy.ndarray.
         """
-        output = []
-        for contour in input_contours:
-            x,y,w,h = cv2.boundingRect(contour)
-            if (w < min_width or w > max_width):
-                continue
-            if (h < min_height or h > max_height):
-                continue
-            area = cv2.contourArea(contour)
-            if (area < min_area):
-                continue
-            if (cv2.arcLength(contour, True) < min_perimeter):
-                continue
-            hull = cv2.convexHull(contour)
-            solid = 100 * area / cv2.contourArea(hull)
-            if (solid < solidity[0] or solid > solidity[1]):
-                continue
-            if (len(contour) < min_vertex_count or len(contour) > max_vertex_count):
-                continue
-            ratio = (float)(w) / h
-            if (ratio < min_ratio or ratio > max_ratio):
-                continue
-            output.append(contour)
-        return output
+        if len(input_contours) == 0:
+            return []
+        rects = numpy.array([cv2.boundingRect(contour) for contour in input_contours]).reshape(-1, 4)
+        w = rects[:, 2]
+        h = rects[:, 3]
+        vertices = numpy.array([len(contour) for contour in input_contours])
+        area = numpy.array([cv2.contourArea(contour) for contour in input_contours])
+        keep = ((w >= min_width) & (w <= max_width)
+                & (h >= min_height) & (h <= max_height)
+                & (area >= min_area)
+                & (vertices >= min_vertex_count) & (vertices <= max_vertex_count))
+        ratio = w / h.astype(float)
+        keep &= (ratio >= min_ratio) & (ratio <= max_ratio)
+        # Perimeter and solidity are only measured on the survivors, and only
+        # when their bounds can reject anything (solidity never exceeds 100).
+        if min_perimeter > 0:
+            for i in numpy.flatnonzero(keep):
+                keep[i] = cv2.arcLength(input_contours[i], True) >= min_perimeter
+        if solidity[0] > 0 or solidity[1] < 100:
+            for i in numpy.flatnonzero(keep):
+                solid = 100 * area[i] / cv2.contourArea(cv2.convexHull(input_contours[i]))
+                keep[i] = solidity[0] <= solid <= solidity[1]
+        return [input_contours[i] for i in numpy.flatnonzero(keep)]
 
 
 
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+# Headless batch analysis of recorded footage: runs the robot's pipeline
+# (makePipeline) and the target finder on every frame, sharded across a
+# process pool, and streams one row per frame to CSV or Parquet.
+#
+#   python batch_analyze.py --output results.csv match1.avi match2.avi frames/
+#   python batch_analyze.py --workers 8 --shard-frames 500 --output results.parquet videos/*.avi
+#
+# Parquet output needs pyarrow. Rows come out in input order whatever order
+# the shards finish in.
+
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+
+import cv2
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import frc2554_vision_final
+from frc2554_vision_final import PoseEstimator, findTarget, image_height, image_width, makePipeline
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+STAGES = [
+    "pipeline.threshold",
+    "pipeline.resize",
+    "pipeline.find_contours",
+    "pipeline.hulls",
+    "pipeline.filter",
+    "target.describe",
+    "target.pairing",
+    "target.result",
+    "pose.solve",
+]
+
+COLUMNS = [
+    "source",
+    "frame",
+    "time_ms",
+    "target_exists",
+    "yaw_angle",
+    "midpoint_x",
+    "midpoint_y",
+    "pair_count",
+    "distance",
+    "target_yaw",
+    "skew",
+    "total_ms",
+] + [stage + "_ms" for stage in STAGES] + ["error"]
+
+
+class FrameTimer:
+    """Collects one frame's stage times; same lap() interface as StageProfiler."""
+
+    def __init__(self):
+        self.times = {}
+
+    def lap(self, name, start):
+        now = time.perf_counter()
+        self.times[name] = self.times.get(name, 0.0) + (now - start) * 1000
+        return now
+
+
+def planShards(paths, shardFrames):
+    """Split every video and image directory into (path, first frame, frame count) shards."""
+    shards = []
+    for path in paths:
+        if os.path.isdir(path):
+            count = len([name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS)])
+        elif path.lower().endswith(IMAGE_EXTENSIONS):
+            count = 1
+        else:
+            cap = cv2.VideoCapture(path)
+            count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+            if count <= 0:
+                # Unknown length: one shard that reads to the end
+                shards.append((path, 0, None))
+                continue
+        for first in range(0, count, shardFrames):
+            shards.append((path, first, min(shardFrames, count - first)))
+    return shards
+
+
+def readShard(path, first, count):
+    """Yield (frame index, milliseconds into the source, frame) for one shard."""
+    if os.path.isdir(path) or path.lower().endswith(IMAGE_EXTENSIONS):
+        if os.path.isdir(path):
+            names = sorted(name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS))
+            files = [os.path.join(path, name) for name in names]
+        else:
+            files = [path]
+        for index in range(first, first + count):
+            yield index, None, cv2.imread(files[index])
+        return
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError("could not open {}".format(path))
+    cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    index = first
+    while count is None or index < first + count:
+        ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield index, ms, frame
+        index += 1
+    cap.release()
+
+
+def initWorker():
+    # One OpenCV thread per process; the pool is the parallelism, and OpenCV's
+    # own threads would fight it for the same cores
+    cv2.setNumThreads(1)
+
+
+def analyzeShard(shard):
+    """Worker: one row dict per frame of the shard."""
+    path, first, count = shard
+    grip = makePipeline()
+    pose = PoseEstimator()
+    timer = FrameTimer()
+    grip.stage_timer = timer
+    # findTarget and PoseEstimator time themselves with the module profiler
+    frc2554_vision_final.profiler = timer
+
+    rows = []
+    try:
+        for index, ms, frame in readShard(path, first, count):
+            row = {"source": path, "frame": index, "time_ms": ms}
+            timer.times.clear()
+            start = time.perf_counter()
+            try:
+                if frame is None:
+                    raise IOError("could not read frame")
+                if frame.shape[:2] != (image_height, image_width):
+                    frame = cv2.resize(frame, (image_width, image_height))
+                grip.process(frame)
+                targetContours, shuffleboard_data = findTarget(grip.filter_contours_output)
+                pose.update(targetContours, shuffleboard_data)
+            except Exception as err:
+                row["error"] = "{}: {}".format(type(err).__name__, err)
+            else:
+                exists = shuffleboard_data["target_exists"]
+                row.update(
+                    target_exists=exists,
+                    yaw_angle=shuffleboard_data["yaw_angle"] if exists else None,
+                    midpoint_x=shuffleboard_data["midpoint"][0] if exists else None,
+                    midpoint_y=shuffleboard_data["midpoint"][1] if exists else None,
+                    pair_count=shuffleboard_data["pair_count"],
+                    distance=shuffleboard_data["distance"] if exists else None,
+                    target_yaw=shuffleboard_data["target_yaw"] if exists else None,
+                    skew=shuffleboard_data["skew"] if exists else None,
+                )
+            row["total_ms"] = (time.perf_counter() - start) * 1000
+            for stage, ms in timer.times.items():
+                row[stage + "_ms"] = ms
+            rows.append(row)
+    except Exception as err:
+        # The source itself failed; keep the frames we got and say why we stopped
+        rows.append({"source": path, "frame": first if not rows else rows[-1]["frame"] + 1,
+                     "error": "{}: {}".format(type(err).__name__, err)})
+    return rows
+
+
+class CsvOutput:
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=COLUMNS, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetOutput:
+    """One row group per shard, so rows stream to disk as shards finish."""
+
+    def __init__(self, path):
+        schema = [("source", pyarrow.string()), ("error", pyarrow.string()), ("target_exists", pyarrow.bool_()),
+                  ("frame", pyarrow.int64()), ("pair_count", pyarrow.int64())]
+        types = dict(schema)
+        self.schema = pyarrow.schema([(name, types.get(name, pyarrow.float64())) for name in COLUMNS])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        columns = {name: [row.get(name) for row in rows] for name in COLUMNS}
+        self.writer.write_table(pyarrow.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze recorded footage headlessly")
+    parser.add_argument("paths", nargs="+", help="videos, image dirs or image files")
+    parser.add_argument("--output", required=True, help=".csv or .parquet")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-frames", type=int, default=300)
+    args = parser.parse_args()
+
+    if args.output.endswith(".parquet"):
+        if pyarrow is None:
+            parser.error("Parquet output needs pyarrow")
+        output = ParquetOutput(args.output)
+    else:
+        output = CsvOutput(args.output)
+
+    shards = planShards(args.paths, args.shard_frames)
+    frames = targets = errors = 0
+    cpuMs = 0.0
+    start = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(args.workers, initWorker) as pool:
+        # imap keeps shard order but still runs shards in parallel
+        for rows in pool.imap(analyzeShard, shards):
+            output.write(rows)
+            frames += len(rows)
+            targets += sum(1 for row in rows if row.get("target_exists"))
+            errors += sum(1 for row in rows if row.get("error"))
+            cpuMs += sum(row.get("total_ms", 0.0) for row in rows)
+            elapsed = time.perf_counter() - start
+            print("\r{} frames  {:.1f} fps".format(frames, frames / elapsed), end="", file=sys.stderr)
+    output.close()
+    elapsed = time.perf_counter() - start
+
+    print(file=sys.stderr)
+    print("frames:        {}".format(frames))
+    print("with target:   {}".format(targets))
+    print("errors:        {}".format(errors))
+    print("workers:       {}  ({} shards)".format(args.workers, len(shards)))
+    print("fps:           {:.1f}  ({:.1f} per worker)".format(frames / elapsed, frames / elapsed / args.workers))
+    print("mean frame:    {:.2f} ms".format(cpuMs / frames if frames else 0.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# Offline benchmark of the vision processing paths over recorded frames.
+#
+#   python benchmark.py frames/ match1.avi --save results.json
+#   python benchmark.py frames/ --baseline results.json --max-regression 0.05
+#
+# Runs frc2554_vision.py (VisionPipeline + processOpenCV),
+# frc2554_vision_final.py (pipeline + findTarget, what its vision thread does;
+# drawing is on the stream thread) and the same with solvePnP pose estimation,
+# without a camera, cscore or NetworkTables. Exits non-zero if fps regressed
+# against the baseline by more than --max-regression. fps, stage times and
+# peak memory are measured in separate passes so the instrumentation doesn't
+# slow down the timed one.
+
+import argparse
+import json
+import resource
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import frc2554_vision
+import frc2554_vision_final
+from compare_pipelines import iterFrames
+
+
+def runLegacy(grip, frame):
+    grip.process(frame)
+    # The old vision loop passed INTER_CUBIC positionally, where cv2.resize
+    # ignores it, so it really resized bilinearly
+    small = cv2.resize(frame, (320, 240), interpolation=cv2.INTER_LINEAR)
+    return frc2554_vision.processOpenCV(small, grip.convex_hulls_output)
+
+
+def runFinal(grip, frame, pose=None):
+    # Only what the vision thread does; drawing and the stream resize happen
+    # on the stream thread
+    grip.process(frame)
+    targetContours, shuffleboard_data = frc2554_vision_final.findTarget(grip.filter_contours_output)
+    if pose:
+        pose.update(targetContours, shuffleboard_data)
+    return targetContours, shuffleboard_data
+
+
+def makeRun(name):
+    """(pipeline, run) for one processing path."""
+    if name == "legacy":
+        return frc2554_vision.VisionPipeline(), runLegacy
+    if name == "pasted":
+        # The VisionPipeline pasted into the script, for comparison with the engine
+        return frc2554_vision_final.VisionPipeline(), runFinal
+    # The pipeline the robot runs
+    grip = frc2554_vision_final.makePipeline()
+    if name == "pose":
+        pose = frc2554_vision_final.PoseEstimator()
+        return grip, lambda grip, frame: runFinal(grip, frame, pose)
+    return grip, runFinal
+
+
+def benchmarkPath(name, frames, repeat, warmup):
+    grip, run = makeRun(name)
+    for frame in frames[:warmup]:
+        run(grip, frame)
+
+    # fps and latency with no instrumentation attached, so every path pays
+    # the same and the numbers are the pipeline's, not the profiler's
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            t = time.perf_counter()
+            run(grip, frame)
+            latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+
+    # Stage times in their own pass; the legacy path has no stages
+    profiler = frc2554_vision_final.StageProfiler(window=len(frames))
+    if name != "legacy":
+        grip.stage_timer = profiler
+        # findTarget reads the module-level profiler
+        frc2554_vision_final.profiler = profiler
+        for frame in frames:
+            run(grip, frame)
+        grip.stage_timer = None
+        frc2554_vision_final.profiler = None
+
+    # tracemalloc slows allocation-heavy code down by half, so peak memory
+    # gets a pass of its own too
+    tracemalloc.start()
+    for frame in frames:
+        run(grip, frame)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "frames": len(latencies),
+        "fps": len(latencies) / elapsed,
+        "latency_ms": {
+            "mean": float(np.mean(latencies) * 1000),
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+        },
+        "stages": profiler.percentiles(),
+        "peak_traced_mb": peak / 1e6,
+    }
+
+
+def checkRegression(results, baseline, max_regression):
+    ok = True
+    for name, result in results["paths"].items():
+        if name not in baseline.get("paths", {}):
+            continue
+        before = baseline["paths"][name]["fps"]
+        after = result["fps"]
+        change = (after - before) / before
+        print("{}: {:.1f} fps -> {:.1f} fps ({:+.1%})".format(name, before, after, change))
+        if change < -max_regression:
+            print("{}: REGRESSION beyond {:.0%}".format(name, max_regression))
+            ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vision processing offline")
+    parser.add_argument("paths", nargs="+", help="image files, image dirs or videos")
+    parser.add_argument("--path", choices=("legacy", "final", "pose", "pasted", "both", "all"), default="both")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--save", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.05)
+    args = parser.parse_args()
+
+    frames = [
+        cv2.resize(frame, (frc2554_vision_final.image_width, frc2554_vision_final.image_height))
+        for _, frame in iterFrames(args.paths)
+    ]
+    if not frames:
+        parser.error("no frames found")
+
+    names = {"both": ["legacy", "final"], "all": ["legacy", "final", "pose", "pasted"]}.get(args.path, [args.path])
+    results = {"corpus": args.paths, "paths": {}}
+    for name in names:
+        result = benchmarkPath(name, frames, args.repeat, args.warmup)
+        results["paths"][name] = result
+        latency = result["latency_ms"]
+        print(
+            "{:<8} {:8.1f} fps  p50 {:6.2f} ms  p95 {:6.2f} ms  p99 {:6.2f} ms  peak {:6.1f} MB".format(
+                name, result["fps"], latency["p50"], latency["p95"], latency["p99"], result["peak_traced_mb"]
+            )
+        )
+        for stage, stats in sorted(result["stages"].items()):
+            print("    {:<22} p50 {:6.2f} ms  p99 {:6.2f} ms".format(stage, stats["p50"], stats["p99"]))
+
+    # ru_maxrss is in kilobytes on Linux
+    results["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("peak RSS {:.1f} MB".format(results["peak_rss_mb"]))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, default=float)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not checkRegression(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Measures vision fps with the in-process thread and with 1..N worker
+# processes, feeding recorded frames through ThreadedInput like a camera.
+#
+#   python benchmark_workers.py --seconds 20 --max-workers 4 frames/
+#   python benchmark_workers.py --max-workers 0 --record /tmp/rec frames/
+#
+# --record adds a row with the match recorder writing to that directory, to
+# measure what recording costs the vision thread.
+#
+# No camera, cscore or NetworkTables needed.
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from compare_pipelines import iterFrames
+from frc2554_vision_final import (
+    MatchRecorder,
+    ProcessVision,
+    RING_SIZE,
+    ThreadedInput,
+    ThreadedVision,
+    image_height,
+    image_width,
+)
+
+
+class CorpusSink:
+    """Replays frames through the cscore CvSink grabFrame contract at a fixed rate."""
+
+    def __init__(self, frames, fps):
+        self.frames = frames
+        self.period = 1.0 / fps if fps > 0 else 0
+        self.index = 0
+        self.timestamp = 0
+        self.nextFrame = time.time()
+
+    def grabFrame(self, img):
+        if self.period:
+            time.sleep(max(self.nextFrame - time.time(), 0))
+            self.nextFrame = max(self.nextFrame + self.period, time.time())
+        frame = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        self.timestamp += 1
+        np.copyto(img, frame)
+        return self.timestamp, img
+
+    def getError(self):
+        return ""
+
+
+def measure(frames, fps, workers, seconds, record=None):
+    sink = CorpusSink(frames, fps)
+    recorder = None
+    if workers > 0:
+        imgetter = ThreadedInput(sink, size=max(RING_SIZE, workers + 2), shared=True).start()
+        vis = ProcessVision(imgetter, workers).start()
+    else:
+        if record:
+            recorder = MatchRecorder(record, root=record).start()
+        imgetter = ThreadedInput(sink).start()
+        vis = ThreadedVision(imgetter, recorder=recorder).start()
+
+    # Let the workers import and warm up before timing
+    lastSeq, _ = vis.waitForResult(0, timeout=30)
+    results = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        seq, _ = vis.waitForResult(lastSeq, timeout=0.5)
+        if seq != lastSeq:
+            results += 1
+            lastSeq = seq
+    elapsed = time.time() - start
+
+    vis.stop()
+    imgetter.close()
+    if recorder:
+        recorder.close()
+        print("recorded {} frames, dropped {}".format(recorder.written, recorder.dropped))
+    return results / elapsed, vis.dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vision worker processes")
+    parser.add_argument("paths", nargs="+", help="image files, image dirs or videos")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--fps", type=float, default=0, help="camera rate, 0 for unpaced")
+    parser.add_argument("--record", help="also measure the thread with a recorder writing here")
+    args = parser.parse_args()
+
+    frames = [
+        cv2.resize(frame, (image_width, image_height))
+        for _, frame in iterFrames(args.paths)
+    ]
+    if not frames:
+        parser.error("no frames found")
+
+    print("{:<10} {:>10} {:>10}".format("workers", "fps", "dropped"))
+    for workers in range(0, args.max_workers + 1):
+        fps, dropped = measure(frames, args.fps, workers, args.seconds)
+        name = "thread" if workers == 0 else str(workers)
+        print("{:<10} {:>10.1f} {:>10}".format(name, fps, dropped))
+        if workers == 0 and args.record:
+            recorded, dropped = measure(frames, args.fps, 0, args.seconds, args.record)
+            print("{:<10} {:>10.1f} {:>10}  ({:+.1%})".format("recording", recorded, dropped, recorded / fps - 1))
+
+
+if __name__ == "__main__":
+    main()
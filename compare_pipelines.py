@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# Checks that a VisionPipeline variant finds the same targets as the default
+# pipeline over a corpus of recorded frames, and times both.
+#
+#   python compare_pipelines.py --resize-first frames/ match1.avi
+#   python compare_pipelines.py --backend components frames/
+#   python compare_pipelines.py --grip-file GRIP_Files/Final420.grip frames/
+#
+# Exits non-zero if the two pipelines disagree more than the tolerances allow.
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from GRIP_Files.finalfourtwenty import VisionPipeline
+from grip_engine import GripPipeline
+from local_testing_new import angleToTarget
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def iterFrames(paths):
+    """Yield (name, BGR frame) for every image / video frame under paths."""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    frame = cv2.imread(os.path.join(path, name))
+                    if frame is not None:
+                        yield os.path.join(path, name), frame
+        elif path.lower().endswith(IMAGE_EXTENSIONS):
+            frame = cv2.imread(path)
+            if frame is not None:
+                yield path, frame
+        else:
+            cap = cv2.VideoCapture(path)
+            idx = 0
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield "{}:{}".format(path, idx), frame
+                idx += 1
+            cap.release()
+
+
+def runPipeline(pipeline, frame):
+    start = time.perf_counter()
+    pipeline.process(frame)
+    elapsed = time.perf_counter() - start
+
+    if pipeline.resize_first:
+        mask = pipeline.rgb_threshold_output
+    else:
+        mask = pipeline.resize_image_output
+    mask = mask > 0
+    small = cv2.resize(frame, (320, 240), interpolation=cv2.INTER_CUBIC)
+    _, angle = angleToTarget(small, pipeline.filter_contours_output)
+    return elapsed, mask, angle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare VisionPipeline variants")
+    parser.add_argument("paths", nargs="+", help="image files, image dirs or videos")
+    parser.add_argument("--resize-first", action="store_true")
+    parser.add_argument("--backend", choices=("contours", "components"), default="contours")
+    parser.add_argument("--grip-file", help="run this .grip file with grip_engine as the candidate")
+    parser.add_argument("--min-iou", type=float, default=0.9)
+    parser.add_argument("--max-angle-diff", type=float, default=1.0)
+    parser.add_argument("--min-agreement", type=float, default=0.98)
+    args = parser.parse_args()
+
+    current = VisionPipeline()
+    if args.grip_file:
+        candidate = GripPipeline.load(args.grip_file)
+    else:
+        candidate = VisionPipeline(resize_first=args.resize_first, backend=args.backend)
+
+    num_frames = 0
+    agree = 0
+    ious = []
+    angle_diffs = []
+    times = {"current": 0.0, "candidate": 0.0}
+
+    for name, frame in iterFrames(args.paths):
+        t1, mask1, angle1 = runPipeline(current, frame)
+        t2, mask2, angle2 = runPipeline(candidate, frame)
+        times["current"] += t1
+        times["candidate"] += t2
+        num_frames += 1
+
+        union = np.count_nonzero(mask1 | mask2)
+        if union:
+            ious.append(np.count_nonzero(mask1 & mask2) / union)
+
+        # angleToTarget reports -420 when no target pair was found
+        found1, found2 = angle1 != -420, angle2 != -420
+        if found1 == found2:
+            agree += 1
+            if found1:
+                angle_diffs.append(abs(angle1 - angle2))
+        else:
+            print("{}: target found by only one pipeline".format(name))
+
+    if num_frames == 0:
+        print("No frames found")
+        sys.exit(1)
+
+    mean_iou = float(np.mean(ious)) if ious else 1.0
+    max_angle_diff = max(angle_diffs) if angle_diffs else 0.0
+    agreement = agree / num_frames
+
+    print("frames:            {}".format(num_frames))
+    print("mask IoU (mean):   {:.4f}".format(mean_iou))
+    print("target agreement:  {:.4f}".format(agreement))
+    print("max angle diff:    {:.3f} deg".format(max_angle_diff))
+    for name, total in times.items():
+        print("{:<18} {:.2f} ms/frame".format(name + ":", 1000 * total / num_frames))
+
+    ok = (
+        mean_iou >= args.min_iou
+        and agreement >= args.min_agreement
+        and max_angle_diff <= args.max_angle_diff
+    )
+    print("EQUIVALENT" if ok else "NOT EQUIVALENT")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -153,8 +153,13 @@ import json
 import time
 import sys
 
-from cscore import CameraServer, VideoSource, UsbCamera, MjpegServer
-from networktables import NetworkTablesInstance
+try:
+    from cscore import CameraServer, VideoSource, UsbCamera, MjpegServer
+    from networktables import NetworkTablesInstance
+except ImportError:
+    # Offline benchmarks only need the vision code
+    CameraServer = VideoSource = UsbCamera = MjpegServer = None
+    NetworkTablesInstance = None
 
 #   JSON format:
 #   {
@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
 
+# Taken before the heavy imports, so the startup profile includes them
+import time
+STARTUP_TIME = time.monotonic()
+
 # ---------------------------------------- #
 #             Begin GRIP Pipeline          #
 # ---------------------------------------- #
@@ -11,25 +15,96 @@ import numpy
 import math
 from enum import Enum
 
+class ColorSegmenter:
+    """
+    Segments a BGR image against GRIP red/green/blue ranges with one inRange
+    on the BGR channels, instead of converting the frame to RGB first.
+    """
+
+    def __init__(self):
+        self.__key = None
+        self.__lower = None
+        self.__upper = None
+        self.__output = None
+
+    @staticmethod
+    def __bounds(red, green, blue):
+        """Turns GRIP ranges into inRange bounds.
+        Args:
+            red: A list of two numbers the are the min and max red.
+            green: A list of two numbers the are the min and max green.
+            blue: A list of two numbers the are the min and max blue.
+        Returns:
+            (lower, upper) tuples of integers in BGR order.
+        """
+        lower = []
+        upper = []
+        for low, high in (blue, green, red):
+            # cv2.inRange rounds fractional bounds to the nearest integer
+            low = max(int(round(low)), 0)
+            high = min(int(round(high)), 255)
+            if low > high:
+                # An empty range matches nothing
+                low, high = 255, 0
+            lower.append(low)
+            upper.append(high)
+        return tuple(lower), tuple(upper)
+
+    def threshold(self, input, red, green, blue):
+        """Segment an image based on color ranges.
+        Args:
+            input: A BGR numpy.ndarray.
+            red: A list of two numbers the are the min and max red.
+            green: A list of two numbers the are the min and max green.
+            blue: A list of two numbers the are the min and max blue.
+        Returns:
+            A black and white numpy.ndarray.
+        """
+        key = (tuple(red), tuple(green), tuple(blue))
+        if key != self.__key:
+            self.__lower, self.__upper = self.__bounds(red, green, blue)
+            self.__key = key
+        if self.__output is None or self.__output.shape != input.shape[:2]:
+            self.__output = numpy.empty(input.shape[:2], dtype=numpy.uint8)
+        return cv2.inRange(input, self.__lower, self.__upper, dst=self.__output)
+
+
 class VisionPipeline:
     """
     An OpenCV pipeline generated by GRIP.
     """
     
-    def __init__(self):
+    def __init__(self, resize_first=False, backend="contours"):
         """initializes all values to presets or None if need to be set
+        Args:
+            resize_first: If true, shrink the color frame (area interpolation)
+                before thresholding instead of resizing the binary mask.
+                Faster, but not equivalent: it finds fewer targets (about 80%
+                against 92% on the synthetic sweep).
+            backend: "contours" traces every blob with findContours,
+                "components" labels blobs with connectedComponentsWithStats and
+                only traces the ones that can pass the filter.
         """
 
+        self.resize_first = resize_first
+        self.backend = backend
+        # Optional object with lap(name, start) -> now, called after every step
+        self.stage_timer = None
+
         self.__rgb_threshold_red = [0.0, 144.92648866498453]
         self.__rgb_threshold_green = [145.14312278990366, 255.0]
         self.__rgb_threshold_blue = [0.0, 144.49355199942204]
 
+        self.__color_segmenter = ColorSegmenter()
+
         self.rgb_threshold_output = None
 
         self.__resize_image_input = self.rgb_threshold_output
         self.__resize_image_width = 320.0
         self.__resize_image_height = 240.0
-        self.__resize_image_interpolation = cv2.INTER_CUBIC
+        # GRIP says CUBIC, but the generated call passed it as fy, so the mask
+        # has always been resized bilinearly; that is what the filter is tuned for
+        self.__resize_image_interpolation = cv2.INTER_LINEAR
 
         self.resize_image_output = None
 
@@ -58,33 +133,97 @@ class VisionPipeline:
         self.filter_contours_output = None
 
 
-    def process(self, source0):
+    def process(self, source0, roi=None):
         """
         Runs the pipeline and sets all outputs to new values.
+        Args:
+            roi: Optional (x, y, width, height) window in resized image
+                coordinates. Only that window is processed, and contours are
+                still reported in resized image coordinates.
         """
-        # Step RGB_Threshold0:
-        self.__rgb_threshold_input = source0
-        (self.rgb_threshold_output) = self.__rgb_threshold(self.__rgb_threshold_input, self.__rgb_threshold_red, self.__rgb_threshold_green, self.__rgb_threshold_blue)
+        timer = self.stage_timer
+        if timer:
+            t = time.perf_counter()
+
+        width = self.__resize_image_width
+        height = self.__resize_image_height
+        offset = (0, 0)
+        if roi is not None:
+            x, y, w, h = roi
+            scale_x = source0.shape[1] / self.__resize_image_width
+            scale_y = source0.shape[0] / self.__resize_image_height
+            source0 = source0[int(y * scale_y):int((y + h) * scale_y), int(x * scale_x):int((x + w) * scale_x)]
+            width, height = w, h
+            offset = (int(x), int(y))
+
+        if self.resize_first:
+            # Step Resize_Image0 (color frame, a quarter of the pixels to threshold):
+            self.__resize_image_input = source0
+            (self.resize_image_output) = self.__resize_image(self.__resize_image_input, width, height, cv2.INTER_AREA)
+            if timer:
+                t = timer.lap("pipeline.resize", t)
+
+            # Step RGB_Threshold0:
+            self.__rgb_threshold_input = self.resize_image_output
+            (self.rgb_threshold_output) = self.__rgb_threshold(self.__rgb_threshold_input, self.__rgb_threshold_red, self.__rgb_threshold_green, self.__rgb_threshold_blue)
+            if timer:
+                t = timer.lap("pipeline.threshold", t)
+
+            self.__find_contours_input = self.rgb_threshold_output
+        else:
+            # Step RGB_Threshold0:
+            self.__rgb_threshold_input = source0
+            (self.rgb_threshold_output) = self.__rgb_threshold(self.__rgb_threshold_input, self.__rgb_threshold_red, self.__rgb_threshold_green, self.__rgb_threshold_blue)
+            if timer:
+                t = timer.lap("pipeline.threshold", t)
 
-        # Step Resize_Image0:
-        self.__resize_image_input = self.rgb_threshold_output
-        (self.resize_image_output) = self.__resize_image(self.__resize_image_input, self.__resize_image_width, self.__resize_image_height, self.__resize_image_interpolation)
+            # Step Resize_Image0:
+            self.__resize_image_input = self.rgb_threshold_output
+            (self.resize_image_output) = self.__resize_image(self.__resize_image_input, width, height, self.__resize_image_interpolation)
+            if timer:
+                t = timer.lap("pipeline.resize", t)
+
+            self.__find_contours_input = self.resize_image_output
 
         # Step Find_Contours0:
-        self.__find_contours_input = self.resize_image_output
-        (self.find_contours_output) = self.__find_contours(self.__find_contours_input, self.__find_contours_external_only)
+        if self.backend == "components":
+            (self.find_contours_output) = self.__find_blob_contours(self.__find_contours_input, self.__filter_contours_min_area, self.__filter_contours_min_width, self.__filter_contours_max_width, self.__filter_contours_min_height, self.__filter_contours_max_height, self.__filter_contours_min_ratio, self.__filter_contours_max_ratio, offset)
+        else:
+            (self.find_contours_output) = self.__find_contours(self.__find_contours_input, self.__find_contours_external_only, offset)
+        if timer:
+            t = timer.lap("pipeline.find_contours", t)
 
         # Step Convex_Hulls0:
         self.__convex_hulls_contours = self.find_contours_output
         (self.convex_hulls_output) = self.__convex_hulls(self.__convex_hulls_contours)
+        if timer:
+            t = timer.lap("pipeline.hulls", t)
 
         # Step Filter_Contours0:
         self.__filter_contours_contours = self.convex_hulls_output
         (self.filter_contours_output) = self.__filter_contours(self.__filter_contours_contours, self.__filter_contours_min_area, self.__filter_contours_min_perimeter, self.__filter_contours_min_width, self.__filter_contours_max_width, self.__filter_contours_min_height, self.__filter_contours_max_height, self.__filter_contours_solidity, self.__filter_contours_max_vertices, self.__filter_contours_min_vertices, self.__filter_contours_min_ratio, self.__filter_contours_max_ratio)
+        if timer:
+            t = timer.lap("pipeline.filter", t)
 
 
-    @staticmethod
-    def __rgb_threshold(input, red, green, blue):
+    def set_resize(self, width, height):
+        """Changes the size the frame is resized to before finding contours.
+        The filter's pixel limits are rescaled so the same targets still pass.
+        Args:
+            width: The new width in pixels.
+            height: The new height in pixels.
+        """
+        scale = width / self.__resize_image_width
+        self.__resize_image_width = float(width)
+        self.__resize_image_height = float(height)
+        self.__filter_contours_min_area *= scale * scale
+        self.__filter_contours_min_perimeter *= scale
+        self.__filter_contours_min_width *= scale
+        self.__filter_contours_max_width *= scale
+        self.__filter_contours_min_height *= scale
+        self.__filter_contours_max_height *= scale
+
+    def __rgb_threshold(self, input, red, green, blue):
         """Segment an image based on color ranges.
         Args:
             input: A BGR numpy.ndarray.
@@ -94,8 +233,7 @@ class VisionPipeline:
         Returns:
             A black and white numpy.ndarray.
         """
-        out = cv2.cvtColor(input, cv2.COLOR_BGR2RGB)
-        return cv2.inRange(out, (red[0], green[0], blue[0]),  (red[1], green[1], blue[1]))
+        return self.__color_segmenter.threshold(input, red, green, blue)
 
     @staticmethod
     def __resize_image(input, width, height, interpolation):
@@ -108,14 +246,15 @@ class VisionPipeline:
         Returns:
             A numpy.ndarray of the new size.
         """
-        return cv2.resize(input, ((int)(width), (int)(height)), 0, 0, interpolation)
+        return cv2.resize(input, ((int)(width), (int)(height)), interpolation=interpolation)
 
     @staticmethod
-    def __find_contours(input, external_only):
+    def __find_contours(input, external_only, offset=(0, 0)):
         """Sets the values of pixels in a binary image to their distance to the nearest black pixel.
         Args:
             input: A numpy.ndarray.
             external_only: A boolean. If true only external contours are found.
+            offset: An (x, y) shift added to every contour point.
         Return:
             A list of numpy.ndarray where each one represents a contour.
         """
@@ -124,9 +263,77 @@ class VisionPipeline:
         else:
             mode = cv2.RETR_LIST
         method = cv2.CHAIN_APPROX_SIMPLE
-        im2, contours, hierarchy =cv2.findContours(input, mode=mode, method=method)
+        im2, contours, hierarchy =cv2.findContours(input, mode=mode, method=method, offset=offset)
         return contours
 
+    @staticmethod
+    def __find_blob_contours(input, min_area, min_width, max_width, min_height, max_height,
+                             min_ratio, max_ratio, offset=(0, 0)):
+        """Finds the external contours of the blobs that can pass the contour filter.
+        Args:
+            input: A numpy.ndarray.
+            min_area: The minimum area of a contour that will be kept.
+            min_width: Minimum width of a contour.
+            max_width: MaxWidth maximum width.
+            min_height: Minimum height.
+            max_height: Maximimum height.
+            min_ratio: Minimum ratio of width to height.
+            max_ratio: Maximum ratio of width to height.
+            offset: An (x, y) shift added to every contour point.
+        Return:
+            A list of numpy.ndarray where each one represents a contour.
+        """
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(input, connectivity=8)
+        x = stats[1:, cv2.CC_STAT_LEFT]
+        y = stats[1:, cv2.CC_STAT_TOP]
+        w = stats[1:, cv2.CC_STAT_WIDTH]
+        h = stats[1:, cv2.CC_STAT_HEIGHT]
+        # The bounding box of a blob is the bounding box of its contour (and
+        # hull), and w * h bounds the hull area from above, so this never drops
+        # a blob the exact filter would keep.
+        ratio = w / h.astype(float)
+        keep = ((w >= min_width) & (w <= max_width)
+                & (h >= min_height) & (h <= max_height)
+                & (w * h >= min_area)
+                & (ratio >= min_ratio) & (ratio <= max_ratio))
+        kept = numpy.flatnonzero(keep)
+        # Only a blob whose box contains another's can enclose it
+        around = ((x[None, :] <= x[kept, None]) & (y[None, :] <= y[kept, None])
+                  & (x[None, :] + w[None, :] >= (x + w)[kept, None])
+                  & (y[None, :] + h[None, :] >= (y + h)[kept, None]))
+        around[numpy.arange(len(kept)), kept] = False
+        output = []
+        for k, i in enumerate(kept):
+            blob = (labels[y[i]:y[i] + h[i], x[i]:x[i] + w[i]] == i + 1).astype(numpy.uint8)
+            # RETR_EXTERNAL never reports a blob sitting in another blob's hole
+            if around[k].any() and VisionPipeline.__in_hole(labels, x, y, w, h, i, numpy.flatnonzero(around[k]), int(numpy.argmax(blob[:, 0]))):
+                continue
+            contours = cv2.findContours(blob, mode=cv2.RETR_EXTERNAL, method=cv2.CHAIN_APPROX_SIMPLE, offset=(int(x[i]) + offset[0], int(y[i]) + offset[1]))[-2]
+            output.extend(contours)
+        return output
+
+    @staticmethod
+    def __in_hole(labels, x, y, w, h, i, around, row):
+        """Whether blob i lies in a hole of another blob.
+        Args:
+            labels: Labels from connectedComponentsWithStats.
+            x, y, w, h: Bounding boxes of the blobs, background excluded.
+            i: The blob to check.
+            around: The other blobs whose boxes contain blob i's.
+            row: A row, relative to its box, where blob i touches its left edge.
+        Return:
+            True if findContours with RETR_EXTERNAL would leave blob i out.
+        """
+        for j in around:
+            # Blob j alone, with a free border so everything outside it connects
+            mask = numpy.zeros((h[j] + 2, w[j] + 2), dtype=numpy.uint8)
+            mask[1:-1, 1:-1] = labels[y[j]:y[j] + h[j], x[j]:x[j] + w[j]] == j + 1
+            cv2.floodFill(mask, None, (0, 0), 2, flags=4)
+            # Pixels still 0 are in j's holes
+            if mask[y[i] - y[j] + row + 1, x[i] - x[j] + 1] == 0:
+                return True
+        return False
+
     @staticmethod
     def __convex_hulls(input_contours):
         """Computes the convex hulls of contours.
@@ -161,29 +368,29 @@ class VisionPipeline:
         Returns:
             Contours as a list of numpy.ndarray.
         """
-        output = []
-        for contour in input_contours:
-            x,y,w,h = cv2.boundingRect(contour)
-            if (w < min_width or w > max_width):
-                continue
-            if (h < min_height or h > max_height):
-                continue
-            area = cv2.contourArea(contour)
-            if (area < min_area):
-                continue
-            if (cv2.arcLength(contour, True) < min_perimeter):
-                continue
-            hull = cv2.convexHull(contour)
-            solid = 100 * area / cv2.contourArea(hull)
-            if (solid < solidity[0] or solid > solidity[1]):
-                continue
-            if (len(contour) < min_vertex_count or len(contour) > max_vertex_count):
-                continue
-            ratio = (float)(w) / h
-            if (ratio < min_ratio or ratio > max_ratio):
-                continue
-            output.append(contour)
-        return output
+        if len(input_contours) == 0:
+            return []
+        rects = numpy.array([cv2.boundingRect(contour) for contour in input_contours]).reshape(-1, 4)
+        w = rects[:, 2]
+        h = rects[:, 3]
+        vertices = numpy.array([len(contour) for contour in input_contours])
+        area = numpy.array([cv2.contourArea(contour) for contour in input_contours])
+        keep = ((w >= min_width) & (w <= max_width)
+                & (h >= min_height) & (h <= max_height)
+                & (area >= min_area)
+                & (vertices >= min_vertex_count) & (vertices <= max_vertex_count))
+        ratio = w / h.astype(float)
+        keep &= (ratio >= min_ratio) & (ratio <= max_ratio)
+        # Perimeter and solidity are only measured on the survivors, and only
+        # when their bounds can reject anything (solidity never exceeds 100).
+        if min_perimeter > 0:
+            for i in numpy.flatnonzero(keep):
+                keep[i] = cv2.arcLength(input_contours[i], True) >= min_perimeter
+        if solidity[0] > 0 or solidity[1] < 100:
+            for i in numpy.flatnonzero(keep):
+                solid = 100 * area[i] / cv2.contourArea(cv2.convexHull(input_contours[i]))
+                keep[i] = solidity[0] <= solid <= solidity[1]
+        return [input_contours[i] for i in numpy.flatnonzero(keep)]
 
 # ---------------------------------------- #
 #             End GRIP Pipeline            #
@@ -201,11 +408,21 @@ class VisionPipeline:
 # ----------------------------------------------------------------------------
 
 import json
-import time
 import sys
 
-from cscore import CameraServer, VideoSource, UsbCamera, MjpegServer
-from networktables import NetworkTablesInstance
+if __name__ == "__mp_main__":
+    # Spawned vision workers never touch the camera or NetworkTables, so
+    # they don't pay for importing them
+    CameraServer = VideoSource = UsbCamera = MjpegServer = None
+    NetworkTablesInstance = None
+else:
+    try:
+        from cscore import CameraServer, VideoSource, UsbCamera, MjpegServer
+        from networktables import NetworkTablesInstance
+    except ImportError:
+        # Offline benchmarks don't need these
+        CameraServer = VideoSource = UsbCamera = MjpegServer = None
+        NetworkTablesInstance = None
 
 #   JSON format:
 #   {
@@ -282,6 +499,9 @@ def readCameraConfig(config):
     # stream properties
     cam.streamConfig = config.get("stream")
 
+    # share of vision CPU when several cameras are configured (optional)
+    cam.priority = config.get("priority", 1)
+
     cam.config = config
 
     cameraConfigs.append(cam)
@@ -367,6 +587,10 @@ import cv2
 cv2.setUseOptimized(True)
 from math import tan, sqrt
 import numpy as np
+from collections import deque
+from threading import Lock
+import os
+import threading
 
 IMAGE_WIDTH = 320
 IMAGE_HEIGHT = 240
@@ -378,16 +602,148 @@ DEG_PER_PIXEL = HFOV / IMAGE_WIDTH
 CENTER_WIDTH_PIXEL = (IMAGE_WIDTH - 1) // 2
 CENTER_HEIGHT_PIXEL = (IMAGE_HEIGHT - 1) // 2
 
+# Shrink the color frame before thresholding; faster but misses more targets
+# (see compare_pipelines.py)
+RESIZE_FIRST = False
+# "contours" or "components" (connectedComponentsWithStats blob detection)
+DETECTION_BACKEND = "contours"
+# Only process a window around the last target, full frame after misses
+ROI_TRACKING = False
+ROI_MAX_MISSES = 5
+
 
-def getContourAngle(contour):
-    rect = cv2.minAreaRect(contour)
-    angle = rect[-1]
+# Per-stage timing; off on the robot unless we're chasing a slow stage
+PROFILE = False
+PROFILE_TRACE = "/tmp/vision_trace.json"
 
-    return angle
 
+class StageProfiler:
+    """Rolling per-stage timings, exportable as Chrome trace-event JSON.
 
-def angleToTarget(img, contours):
-    new_image = img
+    Stages call lap(name, start), which records the time since start and
+    returns now, so consecutive stages can be timed with one variable.
+    Open the trace in chrome://tracing or ui.perfetto.dev.
+    """
+
+    def __init__(self, window=1000, max_events=100000):
+        self.window = window
+        self.samples = {}
+        self.events = deque(maxlen=max_events)
+        self.lock = Lock()
+
+    def lap(self, name, start):
+        end = time.perf_counter()
+        self.record(name, start, end)
+        return end
+
+    def record(self, name, start, end):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(end - start)
+            self.events.append((name, threading.get_ident(), start, end))
+
+    def percentiles(self):
+        """{stage: {"p50", "p95", "p99" in ms, "count"}} over the rolling window."""
+        with self.lock:
+            samples = {name: list(times) for name, times in self.samples.items()}
+        report = {}
+        for name, times in samples.items():
+            p50, p95, p99 = np.percentile(times, [50, 95, 99]) * 1000
+            report[name] = {"p50": p50, "p95": p95, "p99": p99, "count": len(times)}
+        return report
+
+    def printReport(self):
+        for name, stats in sorted(self.percentiles().items()):
+            print(
+                "{:<22} p50 {:7.2f} ms  p95 {:7.2f} ms  p99 {:7.2f} ms".format(
+                    name, stats["p50"], stats["p95"], stats["p99"]
+                )
+            )
+
+    def writeTrace(self, path):
+        with self.lock:
+            events = list(self.events)
+        pid = os.getpid()
+        trace = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": tid,
+            }
+            for name, tid, start, end in events
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+profiler = StageProfiler() if PROFILE else None
+
+
+# Tape pair matching. Tilt is a tape's long axis from vertical in degrees,
+# positive when the top leans right; 2019 tapes lean 14.5 degrees toward
+# each other, so the left tape of a pair is "/" and the right one "\"
+MIN_TAPE_TILT = 4.0
+MAX_TAPE_TILT = 35.0
+# Largest area ratio between the two tapes of a pair
+MAX_PAIR_AREA_RATIO = 4.0
+# Largest vertical offset between the tape centers, in tape heights
+MAX_PAIR_DROP = 1.0
+# How many ranked pairs go out in pair_yaws and pair_midpoints
+MAX_PUBLISHED_PAIRS = 4
+
+
+def describeContours(contours):
+    """Centroid x, centroid y, area, tilt and height of every contour as numpy
+    arrays, from one cv2.moments call per contour."""
+    moments = np.array(
+        [(M["m00"], M["m10"], M["m01"], M["mu20"], M["mu11"], M["mu02"]) for M in map(cv2.moments, contours)],
+        dtype=np.float64,
+    ).reshape(-1, 6)
+    m00, m10, m01, mu20, mu11, mu02 = moments.T
+    # m00 is negative for clockwise contours; dividing by it cancels that
+    safe = np.where(m00 == 0, 1.0, m00)
+    cx = m10 / safe
+    cy = m01 / safe
+    mu20, mu11, mu02 = mu20 / safe, mu11 / safe, mu02 / safe
+
+    # Long axis from the x axis; y points down so "/" comes out negative
+    theta = np.degrees(0.5 * np.arctan2(2 * mu11, mu20 - mu02))
+    tilt = np.where(theta < 0, 90 + theta, theta - 90)
+    # A rectangle h high has a y variance of h^2 / 12
+    height = np.sqrt(12 * np.abs(mu02))
+    return cx, cy, np.abs(m00), tilt, height
+
+
+def matchTapePairs(cx, cy, area, tilt, height):
+    """Pair every "/" tape with the "\\" tape next to it on the right.
+    Returns (left indices, right indices), closest pair to the image center first."""
+    valid = np.flatnonzero((np.abs(tilt) >= MIN_TAPE_TILT) & (np.abs(tilt) <= MAX_TAPE_TILT))
+    valid = valid[np.argsort(cx[valid], kind="stable")]
+    left, right = valid[:-1], valid[1:]
+
+    ok = (tilt[left] > 0) & (tilt[right] < 0)
+    ratio = area[left] / np.maximum(area[right], 1e-6)
+    ok &= (ratio <= MAX_PAIR_AREA_RATIO) & (ratio >= 1 / MAX_PAIR_AREA_RATIO)
+    ok &= np.abs(cy[left] - cy[right]) <= MAX_PAIR_DROP * np.maximum(height[left], height[right])
+    left, right = left[ok], right[ok]
+
+    midX = (cx[left] + cx[right]) / 2
+    midY = (cy[left] + cy[right]) / 2
+    rank = np.argsort(np.hypot(midX - CENTER_WIDTH_PIXEL, midY - CENTER_HEIGHT_PIXEL), kind="stable")
+    return left[rank], right[rank]
+
+
+def findTarget(contours, captureTime=0.0, scale=1.0):
+    """Pick the tape pair closest to the image center out of the filtered contours.
+    scale converts contour pixels to IMAGE_WIDTH x IMAGE_HEIGHT pixels, which
+    everything returned is in.
+    Returns (the two target contours, or [] if there is no target, shuffleboard_data)."""
+    if profiler:
+        t = time.perf_counter()
 
     contour_diff = -500
     c1a = -250
@@ -398,79 +754,58 @@ def angleToTarget(img, contours):
     targetCenter = (999, 999)
     pixelDiff = -6969
     targetExists = False
+    finalCnts = []
+    pairCount = 0
+    pairYaws = []
+    pairMidpoints = []
 
     imgCenter = (CENTER_WIDTH_PIXEL, CENTER_HEIGHT_PIXEL)
-    cv2.circle(
-        img=new_image, center=(imgCenter), radius=3, color=(255, 0, 0), thickness=-1
-    )
 
     if len(contours) >= 2:
-        contours = list(sorted(contours, key=cv2.contourArea))[::-1]
-        cntAngles = [getContourAngle(i) for i in contours]
-
-        finalCnts = []
-        baseAngle = -69
+        cx, cy, area, tilt, height = describeContours(contours)
+        if scale != 1.0:
+            cx, cy, area, height = cx * scale, cy * scale, area * scale * scale, height * scale
+        if profiler:
+            t = profiler.lap("target.describe", t)
+        left, right = matchTapePairs(cx, cy, area, tilt, height)
+        pairCount = len(left)
+        if profiler:
+            t = profiler.lap("target.pairing", t)
+
+        for a, b in zip(left[:MAX_PUBLISHED_PAIRS], right[:MAX_PUBLISHED_PAIRS]):
+            midpoint = (int((int(cx[a]) + int(cx[b])) / 2), int((int(cy[a]) + int(cy[b])) / 2))
+            pairMidpoints.extend(midpoint)
+            pairYaws.append((midpoint[0] - CENTER_WIDTH_PIXEL) * DEG_PER_PIXEL)
+
+        if pairCount:
+            # center1 is the bigger tape of the best pair
+            a, b = left[0], right[0]
+            if area[b] > area[a]:
+                a, b = b, a
+            finalCnts = [contours[a], contours[b]]
+            if scale != 1.0:
+                finalCnts = [(contour * scale).astype(np.float32) for contour in finalCnts]
+
+            center1 = (int(cx[a]), int(cy[a]))
+            center2 = (int(cx[b]), int(cy[b]))
+            c1a = float(tilt[a])
+            c2a = float(tilt[b])
+            contour_diff = abs(c1a - c2a)
 
-        for idx, i in enumerate(cntAngles):
-            if idx == 0:
-                finalCnts.append(contours[idx])
-                baseAngle = i
-            else:
-                diff = abs((i % 360) - (baseAngle % 360))
-                c1a = i % 360
-                c2a = baseAngle % 360
-                contour_diff = diff
-                if diff > 55 and diff < 80:
-                    finalCnts.append(contours[idx])
-                    break
-        if not len(finalCnts) < 2:
-            finalCnts = list(sorted(finalCnts, key=cv2.contourArea))[::-1]
-            cnt1 = finalCnts[0]
-            cnt2 = finalCnts[1]
-
-            cv2.drawContours(new_image, finalCnts, -1, color=(255, 0, 0), thickness=2)
-
-            M1 = cv2.moments(cnt1)
-            M2 = cv2.moments(cnt2)
-
-            center1 = (int(M1["m10"] / M1["m00"]), int(M1["m01"] / M1["m00"]))
-            center2 = (int(M2["m10"] / M2["m00"]), int(M2["m01"] / M2["m00"]))
-
-            # cv2.circle(
-            #     img=new_image, center=center1, radius=3, color=(0, 0, 255), thickness=-1
-            # )
-            # cv2.circle(
-            #     img=new_image, center=center2, radius=3, color=(0, 0, 255), thickness=-1
-            # )
-
-            # Draw the midpoint of both of these contours
             targetCenter = (
                 int((center1[0] + center2[0]) / 2),
                 int((center1[1] + center2[1]) / 2),
             )
-            cv2.circle(
-                img=new_image,
-                center=targetCenter,
-                radius=3,
-                color=(0, 0, 255),
-                thickness=-1,
-            )
 
             angle = (targetCenter[0] - CENTER_WIDTH_PIXEL) * DEG_PER_PIXEL
             targetExists = True
-            cv2.putText(
-                new_image,
-                str(round(angle, 2)) + " deg",
-                (0, 25),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                1,
-                color=(0, 255, 255),
-                thickness=2,
-            )
-
-            cv2.line(new_image, targetCenter, imgCenter, (255, 0, 0), 2)
             pixelDiff = targetCenter[0] - imgCenter[0]
-    
+            if profiler:
+                t = profiler.lap("target.result", t)
+
+    if not targetExists:
+        finalCnts = []
+
     shuffleboard_data = {
         "target_exists": targetExists,
         "center1": center1,
@@ -480,77 +815,1588 @@ def angleToTarget(img, contours):
         "yaw_angle": angle,
         "contour_diff": contour_diff,
         "c1a": c1a,
-        "c2a": c2a
+        "c2a": c2a,
+        # Every matched pair, best first, padded so the layout never changes
+        "pair_count": pairCount,
+        "pair_yaws": tuple(pairYaws + [-420] * (MAX_PUBLISHED_PAIRS - len(pairYaws))),
+        "pair_midpoints": tuple(pairMidpoints + [999] * (2 * MAX_PUBLISHED_PAIRS - len(pairMidpoints))),
+        "capture_time": captureTime,
     }
-    return new_image, shuffleboard_data
+    return finalCnts, shuffleboard_data
+
+
+def drawTarget(img, targetContours, shuffleboard_data, scale=1.0):
+    """Draw the target overlay on img, which is IMAGE_WIDTH * scale pixels wide."""
+    if profiler:
+        t = time.perf_counter()
+
+    def point(p):
+        return (int(p[0] * scale), int(p[1] * scale))
+
+    imgCenter = point((CENTER_WIDTH_PIXEL, CENTER_HEIGHT_PIXEL))
+    radius = max(1, int(round(3 * scale)))
+    thickness = max(1, int(round(2 * scale)))
+
+    cv2.circle(
+        img=img, center=(imgCenter), radius=radius, color=(255, 0, 0), thickness=-1
+    )
+    if shuffleboard_data["target_exists"]:
+        # Target contours are float32 when processed at another resolution
+        targetContours = [(c * scale).astype(np.int32) for c in targetContours]
+        cv2.drawContours(img, targetContours, -1, color=(255, 0, 0), thickness=thickness)
+
+        # Draw the midpoint of both of these contours
+        targetCenter = point(shuffleboard_data["midpoint"])
+        cv2.circle(
+            img=img,
+            center=targetCenter,
+            radius=radius,
+            color=(0, 0, 255),
+            thickness=-1,
+        )
+        cv2.putText(
+            img,
+            str(round(shuffleboard_data["yaw_angle"], 2)) + " deg",
+            (0, int(25 * scale)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            scale,
+            color=(0, 255, 255),
+            thickness=thickness,
+        )
+
+        cv2.line(img, targetCenter, imgCenter, (255, 0, 0), thickness)
+    if profiler:
+        profiler.lap("target.draw", t)
+    return img
+
+
+def angleToTarget(img, contours, captureTime=0.0):
+    """findTarget plus the overlay, drawn on img (IMAGE_WIDTH x IMAGE_HEIGHT)."""
+    targetContours, shuffleboard_data = findTarget(contours, captureTime)
+    return drawTarget(img, targetContours, shuffleboard_data), shuffleboard_data
+
+
+def stampResult(shuffleboard_data):
+    """Add the processing-complete time and the capture-to-result latency."""
+    now = time.monotonic()
+    shuffleboard_data["processed_time"] = now
+    shuffleboard_data["latency_ms"] = (now - shuffleboard_data["capture_time"]) * 1000
+
+
+# Distance, bearing and skew from solvePnP on the matched tape pair
+POSE_ESTIMATION = True
+# Written by a calibration run, for images `width` pixels wide:
+# {"width": 640, "camera_matrix": [[fx, 0, cx], [0, fy, cy], [0, 0, 1]], "distortion": [k1, k2, p1, p2, k3]}
+CALIBRATION_FILE = "/boot/camera_calibration.json"
+# Warm-started solves that reproject worse than this many pixels are redone from scratch
+MAX_REPROJECTION_ERROR = 2.0
+
+# 2019 vision target: two 2" x 5.5" tapes tilted 14.5 deg toward each
+# other, 8" apart at their closest points
+TAPE_WIDTH = 2.0
+TAPE_HEIGHT = 5.5
+TAPE_ANGLE = 14.5
+TAPE_GAP = 8.0
+
+
+def tapeModel():
+    """Corners of the left and right tape in target inches, x right and y up."""
+    half_w, half_h = TAPE_WIDTH / 2, TAPE_HEIGHT / 2
+    rect = np.array([[-half_w, -half_h], [half_w, -half_h], [half_w, half_h], [-half_w, half_h]])
+    # The left tape leans right at the top, the right tape leans left
+    a = np.radians(-TAPE_ANGLE)
+    rotation = np.array([[np.cos(a), -np.sin(a)], [np.sin(a), np.cos(a)]])
+    left = rect.dot(rotation.T)
+    left[:, 0] -= left[:, 0].max() + TAPE_GAP / 2
+    right = left * [-1, 1]
+    return left, right
+
+
+TAPES = tapeModel()
+
+
+def sortCorners(corners):
+    """Order the 4 corners of a tape by angle around its center, y down."""
+    center = corners.mean(axis=0)
+    return corners[np.argsort(np.arctan2(corners[:, 1] - center[1], corners[:, 0] - center[0]))]
+
+
+# Left tape then right tape, y flipped to point down like the image, on z = 0
+TARGET_POINTS = np.hstack([
+    np.vstack([sortCorners(tape * [1, -1]) for tape in TAPES]),
+    np.zeros((8, 1)),
+])
+
+
+def idealIntrinsics(width=IMAGE_WIDTH, height=IMAGE_HEIGHT):
+    """Camera matrix and distortion of a distortion-free camera with HFOV."""
+    focal = (width / 2) / tan(np.radians(HFOV / 2))
+    matrix = np.array([[focal, 0, (width - 1) / 2], [0, focal, (height - 1) / 2], [0, 0, 1]])
+    return matrix, np.zeros(5)
+
+
+def loadIntrinsics(path=CALIBRATION_FILE, width=IMAGE_WIDTH, height=IMAGE_HEIGHT):
+    """Camera matrix and distortion coefficients for width x height images.
+    Falls back to idealIntrinsics if the camera hasn't been calibrated."""
+    try:
+        with open(path) as f:
+            calibration = json.load(f)
+    except (OSError, ValueError):
+        return idealIntrinsics(width, height)
+
+    matrix = np.array(calibration["camera_matrix"], dtype=np.float64)
+    matrix[:2] *= width / calibration["width"]
+    return matrix, np.array(calibration["distortion"], dtype=np.float64)
+
+
+class PoseEstimator:
+    """Runs solvePnP on the corners of the matched tapes, starting from the
+    previous frame's pose so the iterative solver converges in a few steps.
+
+    Adds to shuffleboard_data:
+        distance: Inches from the camera to the target center along the floor.
+        target_yaw: Degrees from the camera axis to the target center.
+        skew: Degrees the target is turned away from facing the camera.
+        pose_error: RMS reprojection error in pixels.
+    """
+
+    def __init__(self, intrinsics=None):
+        self.matrix, self.distortion = intrinsics or loadIntrinsics()
+        self.rvec = None
+        self.tvec = None
+        self.warmSolves = 0
+        self.coldSolves = 0
+
+    def imagePoints(self, targetContours):
+        boxes = [cv2.boxPoints(cv2.minAreaRect(contour)) for contour in targetContours]
+        boxes.sort(key=lambda box: box[:, 0].mean())
+        return np.vstack([sortCorners(box) for box in boxes]).astype(np.float64)
+
+    def solve(self, points, warm):
+        if warm:
+            ok, rvec, tvec = cv2.solvePnP(
+                TARGET_POINTS, points, self.matrix, self.distortion,
+                self.rvec.copy(), self.tvec.copy(), True, cv2.SOLVEPNP_ITERATIVE,
+            )
+        else:
+            ok, rvec, tvec = cv2.solvePnP(
+                TARGET_POINTS, points, self.matrix, self.distortion, flags=cv2.SOLVEPNP_ITERATIVE
+            )
+        if not ok:
+            return None
+        projected, _ = cv2.projectPoints(TARGET_POINTS, rvec, tvec, self.matrix, self.distortion)
+        error = sqrt(np.mean(np.sum((projected.reshape(-1, 2) - points) ** 2, axis=1)))
+        return rvec, tvec, error
+
+    def update(self, targetContours, shuffleboard_data):
+        if profiler:
+            start = time.perf_counter()
+
+        distance = -1
+        yaw = -420
+        skew = -420
+        error = -1
+        result = None
+        if shuffleboard_data["target_exists"]:
+            points = self.imagePoints(targetContours)
+            if self.rvec is not None:
+                result = self.solve(points, warm=True)
+                self.warmSolves += 1
+            if result is None or result[2] > MAX_REPROJECTION_ERROR:
+                result = self.solve(points, warm=False)
+                self.coldSolves += 1
+
+        if result is None:
+            # Don't warm-start from a target we lost
+            self.rvec = self.tvec = None
+        else:
+            self.rvec, self.tvec, error = result
+            x, _, z = self.tvec.ravel()
+            distance = float(np.hypot(x, z))
+            yaw = float(np.degrees(np.arctan2(x, z)))
+            rotation, _ = cv2.Rodrigues(self.rvec)
+            skew = float(np.degrees(np.arctan2(-rotation[2, 0], rotation[0, 0]))) - yaw
+
+        shuffleboard_data["distance"] = distance
+        shuffleboard_data["target_yaw"] = yaw
+        shuffleboard_data["skew"] = skew
+        shuffleboard_data["pose_error"] = float(error)
+        if profiler:
+            profiler.lap("pose.solve", start)
+
+
+# Kalman tracking of targets across frames, published between vision results
+TRACKING = True
+TRACK_RATE = 100
+# A track coasts on its prediction this long without a detection, then is dropped
+TRACK_MAX_COAST = 0.3
+# Detections before a track is fully trusted
+TRACK_CONFIRM_HITS = 3
+# A detection joins a track if its midpoint is this many pixels from the prediction
+TRACK_GATE = 40.0
+# Tracked channels: midpoint x, midpoint y (pixels), yaw (degrees), distance (inches)
+TRACK_ACCEL_NOISE = np.array([400.0, 400.0, 100.0, 200.0])
+TRACK_MEASUREMENT_NOISE = np.array([1.0, 1.0, 0.3, 2.0])
+
+
+class TargetTrack:
+    """Constant-velocity Kalman filter for one target, one independent
+    position/velocity filter per channel so a detection can update some
+    channels (a pair without a pose has no distance) and not others."""
+
+    def __init__(self, measurement, mask, t):
+        self.x = np.where(mask, measurement, 0.0)
+        self.v = np.zeros(len(measurement))
+        self.P = np.zeros((len(measurement), 2, 2))
+        self.P[:, 0, 0] = np.where(mask, TRACK_MEASUREMENT_NOISE ** 2, 1e6)
+        self.P[:, 1, 1] = 1e4
+        self.measured = mask.copy()
+        self.t = t
+        self.lastSeen = t
+        self.hits = 1
+
+    def predict(self, t):
+        """(position, velocity, covariance) at time t; the track is unchanged."""
+        dt = max(t - self.t, 0.0)
+        x = self.x + self.v * dt
+        P = self.P.copy()
+        # F P F^T for F = [[1, dt], [0, 1]], plus white acceleration noise
+        P[:, 0, 0] += dt * (self.P[:, 0, 1] + self.P[:, 1, 0]) + dt * dt * self.P[:, 1, 1]
+        P[:, 0, 1] += dt * self.P[:, 1, 1]
+        P[:, 1, 0] += dt * self.P[:, 1, 1]
+        q = TRACK_ACCEL_NOISE ** 2
+        P[:, 0, 0] += q * dt ** 4 / 4
+        P[:, 0, 1] += q * dt ** 3 / 2
+        P[:, 1, 0] += q * dt ** 3 / 2
+        P[:, 1, 1] += q * dt ** 2
+        return x, self.v, P
+
+    def update(self, measurement, mask, t):
+        x, v, P = self.predict(t)
+        S = P[:, 0, 0] + TRACK_MEASUREMENT_NOISE ** 2
+        K = P[:, :, 0] / S[:, None]
+        innovation = np.where(mask, measurement - x, 0.0)
+        self.x = x + K[:, 0] * innovation
+        self.v = v + K[:, 1] * innovation
+        # (I - K H) P with H = [1, 0]
+        updated = P - K[:, :, None] * P[:, None, 0, :]
+        self.P = np.where(mask[:, None, None], updated, P)
+        self.measured |= mask
+        self.t = t
+        self.lastSeen = t
+        self.hits += 1
+
+    def confidence(self, t):
+        """1 for a confirmed track seen this frame, fading to 0 as it coasts."""
+        confirmed = min(self.hits, TRACK_CONFIRM_HITS) / TRACK_CONFIRM_HITS
+        return confirmed * max(0.0, 1 - (t - self.lastSeen) / TRACK_MAX_COAST)
+
+
+class TargetTracker:
+    """Follows every matched tape pair across frames and reports the primary
+    target (the best pair's track) predicted to any time, so results can go
+    out at TRACK_RATE and coast through dropped detections."""
+
+    def __init__(self):
+        self.tracks = []
+        self.primary = None
+
+    def detections(self, shuffleboard_data):
+        """(measurement, mask) for every published pair, best first."""
+        detections = []
+        midpoints = shuffleboard_data["pair_midpoints"]
+        for i in range(min(shuffleboard_data["pair_count"], MAX_PUBLISHED_PAIRS)):
+            # Only the best pair has a pose
+            distance = shuffleboard_data.get("distance", -1) if i == 0 else -1
+            measurement = np.array(
+                [midpoints[2 * i], midpoints[2 * i + 1], shuffleboard_data["pair_yaws"][i], distance],
+                dtype=np.float64,
+            )
+            detections.append((measurement, np.array([True, True, True, distance > 0])))
+        return detections
+
+    def update(self, shuffleboard_data):
+        t = shuffleboard_data["capture_time"]
+        self.tracks = [track for track in self.tracks if t - track.lastSeen <= TRACK_MAX_COAST]
+
+        unmatched = list(self.tracks)
+        best = None
+        for i, (measurement, mask) in enumerate(self.detections(shuffleboard_data)):
+            nearest = None
+            nearestDistance = TRACK_GATE
+            for track in unmatched:
+                x, _, _ = track.predict(t)
+                gap = np.hypot(x[0] - measurement[0], x[1] - measurement[1])
+                if gap < nearestDistance:
+                    nearest, nearestDistance = track, gap
+            if nearest is None:
+                nearest = TargetTrack(measurement, mask, t)
+                self.tracks.append(nearest)
+            else:
+                unmatched.remove(nearest)
+                nearest.update(measurement, mask, t)
+            if i == 0:
+                best = nearest
+
+        if best is not None:
+            self.primary = best
+        elif self.primary not in self.tracks:
+            self.primary = max(self.tracks, key=lambda track: track.confidence(t), default=None)
+
+    def output(self, t):
+        """The primary target predicted to time t (time.monotonic())."""
+        track = self.primary
+        if track is None or t - track.lastSeen > TRACK_MAX_COAST:
+            return {
+                "track_exists": False,
+                "track_midpoint": (999.0, 999.0),
+                "track_yaw": -420.0,
+                "track_yaw_rate": 0.0,
+                "track_distance": -1.0,
+                "track_confidence": 0.0,
+                "track_age_ms": -1.0,
+                "track_count": len(self.tracks),
+            }
+        x, v, _ = track.predict(t)
+        return {
+            "track_exists": True,
+            "track_midpoint": (float(x[0]), float(x[1])),
+            "track_yaw": float(x[2]),
+            "track_yaw_rate": float(v[2]),
+            "track_distance": float(x[3]) if track.measured[3] else -1.0,
+            "track_confidence": track.confidence(t),
+            "track_age_ms": (t - track.lastSeen) * 1000,
+            "track_count": len(self.tracks),
+        }
+
+
+class VisionPublisher:
+    """Writes vision results to NetworkTables.
+
+    publish() only sets values; the main loop calls ninst.flush() once per
+    iteration, after every publisher has written, because pynetworktables
+    drops a flush that comes within 5 ms of the previous one.
+
+    Entry handles are looked up once and a value is only written when it
+    changed. In packed mode the whole result also goes out as one number
+    array, "result", laid out as described by the "result_layout" string;
+    string values are left out of it.
+    """
+
+    def __init__(self, ninst, table, packed=None):
+        self.ninst = ninst
+        self.table = table
+        # PACKED_RESULTS is set further down, with the other threading options
+        self.packed = PACKED_RESULTS if packed is None else packed
+        self.entries = {}
+        self.last = {}
+        self.layout = None
+        self.record = table.getEntry("result")
+        # Updates go out on the loop's flush(); the short periodic timer only
+        # backs up a flush that was dropped
+        ninst.setUpdateRate(0.05)
+
+    def entry(self, name):
+        if name not in self.entries:
+            self.entries[name] = self.table.getEntry(name)
+        return self.entries[name]
+
+    def publish(self, shuffleboard_data):
+        for name, value in shuffleboard_data.items():
+            if self.last.get(name) != value:
+                self.entry(name).setValue(value)
+                self.last[name] = value
+
+        if self.packed:
+            record = []
+            layout = []
+            for name, value in shuffleboard_data.items():
+                if isinstance(value, str):
+                    # Names like "camera" only go out as their own entry
+                    continue
+                if isinstance(value, (tuple, list)):
+                    record.extend(float(v) for v in value)
+                    layout.extend("{}.{}".format(name, i) for i in range(len(value)))
+                else:
+                    record.append(float(value))
+                    layout.append(name)
+            if layout != self.layout:
+                self.entry("result_layout").setString(",".join(layout))
+                self.layout = layout
+            self.record.setDoubleArray(record)
+
+
+class ServerClock:
+    """Estimates the NetworkTables server (robot) clock from time.monotonic().
+
+    Every interval we write our time to clock_ping, and the robot answers by
+    writing [ping, robot time in seconds] to clock_pong. The answer with the
+    shortest round trip gives the offset. Until the robot answers the offset
+    is 0 and clock_synced is false.
+    """
+
+    def __init__(self, table, interval=1.0):
+        self.ping = table.getEntry("clock_ping")
+        self.pong = table.getEntry("clock_pong")
+        self.interval = interval
+        self.offset = 0.0
+        self.synced = False
+        self.bestRoundTrip = float("inf")
+        self.lastPing = 0.0
+        self.lastAnswered = None
+
+    def update(self):
+        now = time.monotonic()
+        pong = self.pong.getDoubleArray([])
+        if len(pong) == 2 and pong[0] != self.lastAnswered:
+            ping, robotTime = pong
+            self.lastAnswered = ping
+            roundTrip = now - ping
+            # Loose bound so the estimate can follow slow drift
+            if 0 <= roundTrip <= 2 * self.bestRoundTrip:
+                self.bestRoundTrip = min(self.bestRoundTrip, roundTrip)
+                self.offset = robotTime - (ping + roundTrip / 2)
+                self.synced = True
+        if now - self.lastPing >= self.interval:
+            self.ping.setDouble(now)
+            self.lastPing = now
+
+    def toServer(self, t):
+        return t + self.offset
+
+
+class RoiTracker:
+    """Predicts a processing window around the last target that was found.
+
+    Windows are (x, y, width, height) in IMAGE_WIDTH x IMAGE_HEIGHT pixels, so
+    the contours the pipeline returns stay in full-frame coordinates.
+    """
+
+    def __init__(self, max_misses=ROI_MAX_MISSES, margin=1.0, min_size=(64, 48)):
+        self.max_misses = max_misses
+        self.margin = margin
+        self.min_size = min_size
+        self.roi = None
+        self.misses = 0
+        self.lastCenter = None
+        self.velocity = (0, 0)
+
+    def reset(self):
+        self.roi = None
+        self.misses = 0
+        self.lastCenter = None
+        self.velocity = (0, 0)
+
+    def window(self):
+        return self.roi
+
+    def update(self, shuffleboard_data, contours, roi):
+        """Predict the next window from this frame's result.
+        Args:
+            shuffleboard_data: The dict returned by findTarget.
+            contours: The filtered contours that were passed to findTarget.
+            roi: The window this frame was processed with, or None.
+        """
+        if not shuffleboard_data["target_exists"]:
+            self.misses += 1
+            if self.misses >= self.max_misses:
+                self.reset()
+            return
+
+        if roi is not None and self.__touchesEdge(contours, roi):
+            self.reset()
+            return
+
+        center = shuffleboard_data["midpoint"]
+        if self.lastCenter is not None:
+            self.velocity = (center[0] - self.lastCenter[0], center[1] - self.lastCenter[1])
+        self.lastCenter = center
+        self.misses = 0
+
+        pairWidth = abs(shuffleboard_data["center1"][0] - shuffleboard_data["center2"][0])
+        half = pairWidth * (0.5 + self.margin)
+        width = min(max(int(2 * half), self.min_size[0]), IMAGE_WIDTH)
+        height = min(max(int(2 * half), self.min_size[1]), IMAGE_HEIGHT)
+        x = int(center[0] + self.velocity[0] - width // 2)
+        y = int(center[1] + self.velocity[1] - height // 2)
+        x = min(max(x, 0), IMAGE_WIDTH - width)
+        y = min(max(y, 0), IMAGE_HEIGHT - height)
+        self.roi = (x, y, width, height)
+
+    @staticmethod
+    def __touchesEdge(contours, roi):
+        rx, ry, rw, rh = roi
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if (x <= rx and rx > 0) or (y <= ry and ry > 0):
+                return True
+            if (x + w >= rx + rw and rx + rw < IMAGE_WIDTH) or (
+                y + h >= ry + rh and ry + rh < IMAGE_HEIGHT
+            ):
+                return True
+        return False
+
+
+# GRIP pipeline run by grip_engine instead of the VisionPipeline pasted
+# above, so retuning is a matter of saving the .grip file. On the Pi, upload
+# grip_engine.py and Final420.grip next to this file; in a checkout the one in
+# GRIP_Files is used. The pasted pipeline is used when there is no .grip
+# file or no grip_engine, or when RESIZE_FIRST, DETECTION_BACKEND or
+# ROI_TRACKING need it.
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_FILE = next(
+    (path for path in (os.path.join(SCRIPT_DIR, "Final420.grip"),
+                       os.path.join(SCRIPT_DIR, "GRIP_Files", "Final420.grip"))
+     if os.path.exists(path)),
+    None,
+)
+
+
+def makePipeline(roi_tracking=False):
+    """A fresh vision pipeline for one thread or worker."""
+    usePasted = RESIZE_FIRST or DETECTION_BACKEND != "contours" or roi_tracking
+    if PIPELINE_FILE and not usePasted:
+        try:
+            from grip_engine import GripPipeline
+        except ImportError:
+            pass
+        else:
+            return GripPipeline.load(PIPELINE_FILE)
+    return VisionPipeline(resize_first=RESIZE_FIRST, backend=DETECTION_BACKEND)
+
+
+# Closed-loop processing resolution: hold TARGET_FPS, and spend pixels on small targets
+DYNAMIC_RESOLUTION = True
+TARGET_FPS = 60
+PROCESSING_WIDTHS = [160, 320, 640]
+# Apparent width of the tape pair, in processing pixels, above which the next
+# lower resolution still resolves it, and below which it needs a higher one
+LARGE_TARGET_PIXELS = 120
+SMALL_TARGET_PIXELS = 30
+# Frames in a row a switch has to be wanted before it happens
+RESOLUTION_HOLD_FRAMES = 15
+
+
+class ResolutionController:
+    """Picks the resolution VisionPipeline processes the next frame at, from
+    measured processing time and the apparent size of the target.
+
+    Results stay in IMAGE_WIDTH x IMAGE_HEIGHT pixels whatever the processing
+    resolution; scale converts processing pixels to those, so DEG_PER_PIXEL
+    and the center constants hold for every resolution.
+    """
+
+    def __init__(self, grip, widths=PROCESSING_WIDTHS, target_fps=TARGET_FPS):
+        self.grip = grip
+        self.widths = widths
+        self.budget = 1.0 / target_fps
+        self.level = widths.index(IMAGE_WIDTH) if IMAGE_WIDTH in widths else 0
+        self.frameTime = None
+        self.wanted = 0
+        self.held = 0
+        self.switches = 0
+        self.apply()
+
+    def apply(self):
+        width = self.widths[self.level]
+        self.grip.set_resize(width, width * IMAGE_HEIGHT // IMAGE_WIDTH)
+        self.width = width
+        self.scale = IMAGE_WIDTH / width
+
+    def update(self, seconds, shuffleboard_data):
+        """Record one frame's processing time and result; may change the
+        resolution for the next frame."""
+        if self.frameTime is None:
+            self.frameTime = seconds
+        else:
+            self.frameTime += 0.1 * (seconds - self.frameTime)
+
+        size = 0
+        if shuffleboard_data["target_exists"]:
+            size = abs(shuffleboard_data["center1"][0] - shuffleboard_data["center2"][0]) / self.scale
+
+        want = 0
+        if self.level > 0 and (self.frameTime > 0.9 * self.budget or size > LARGE_TARGET_PIXELS):
+            want = -1
+        elif self.level < len(self.widths) - 1 and size < SMALL_TARGET_PIXELS:
+            # Cost goes with the pixel count
+            cost = (self.widths[self.level + 1] / self.width) ** 2
+            if self.frameTime * cost < 0.7 * self.budget:
+                want = 1
+
+        if want and want == self.wanted:
+            self.held += 1
+        else:
+            self.wanted = want
+            self.held = 1 if want else 0
+        if self.held >= RESOLUTION_HOLD_FRAMES:
+            width = self.width
+            self.level += want
+            self.apply()
+            self.frameTime *= (self.width / width) ** 2
+            self.wanted = 0
+            self.held = 0
+            self.switches += 1
+
+
+# Give up waiting for a target and report the startup profile anyway after this long
+STARTUP_REPORT_TIMEOUT = 10.0
+
+
+class StartupProfile:
+    """Milliseconds from STARTUP_TIME to each startup milestone.
+
+    Each milestone is recorded the first time it is marked. The profile is
+    printed and published to Shuffleboard/Vision/startup once the first
+    target is found, or STARTUP_REPORT_TIMEOUT after the first result.
+    """
+
+    def __init__(self):
+        self.marks = {}
+        self.lock = Lock()
+        self.reported = False
+
+    def mark(self, name):
+        with self.lock:
+            if name not in self.marks:
+                self.marks[name] = (time.monotonic() - STARTUP_TIME) * 1000
+
+    def result(self, shuffleboard_data, table):
+        """Note a vision result; reports the profile when it's complete."""
+        if self.reported:
+            return
+        self.mark("first_result")
+        if shuffleboard_data["target_exists"]:
+            self.mark("first_target")
+        elif (time.monotonic() - STARTUP_TIME) * 1000 - self.marks["first_result"] < STARTUP_REPORT_TIMEOUT * 1000:
+            return
+        self.reported = True
+
+        print("Startup profile (ms since start):")
+        last = 0.0
+        subtable = table.getSubTable("startup")
+        for name, ms in sorted(self.marks.items(), key=lambda mark: mark[1]):
+            print("    {:<16} {:8.1f}  (+{:.1f})".format(name, ms, ms - last))
+            subtable.getEntry(name).setDouble(ms)
+            last = ms
+
+
+startup = StartupProfile()
+
+
+def warmUp(grip, pose=None):
+    """Run a drawn target through the pipeline once, so OpenCV's lazy setup
+    (thread pool, kernels, buffers) isn't paid for on the first real frame."""
+    frame = np.zeros((image_height, image_width, 3), dtype=np.uint8)
+    inch = image_width / 100
+    for tape in TAPES:
+        points = np.column_stack([image_width / 2 + tape[:, 0] * inch, image_height / 2 - tape[:, 1] * inch])
+        cv2.fillPoly(frame, [np.int32(points)], (90, 255, 80))
+    grip.process(frame)
+    output = findTarget(grip.filter_contours_output)
+    if pose:
+        pose.update(*output)
+        pose.rvec = pose.tvec = None
+
+
+from threading import Thread, Condition
+import heapq
+import multiprocessing
+import queue
+
+# Number of vision worker processes; 0 runs vision in a thread of this process
+VISION_WORKERS = 0
+
+# Also publish every result as one number array so the robot never reads a
+# half-updated target
+PACKED_RESULTS = True
+
+# Record what the camera saw, and what we made of it, for every processed frame
+RECORD = False
+RECORD_DIR = "/home/pi/recordings"
+# "mask" records the thresholded image the contours came from, "frame" the camera frame
+RECORD_MODE = "mask"
+# Frames per memory-mapped chunk file
+RECORD_CHUNK_FRAMES = 256
+# Frames between syncs of a chunk to disk; a power cut loses at most this many
+RECORD_SYNC_FRAMES = 30
+# Oldest chunks under RECORD_DIR are deleted to stay under this
+RECORD_QUOTA_MB = 2000
+# Frames waiting for the writer; when it falls behind, drop the "newest" or "oldest"
+RECORD_QUEUE = 8
+RECORD_DROP = "newest"
+
+
+class MatchRecorder:
+    """Appends frames, capture timestamps and results to a chunked log on a
+    background thread, without ever blocking the vision thread.
+
+    A session directory holds recording.json and numbered chunks: a .npy
+    array of RECORD_CHUNK_FRAMES images, written through a memory map, and
+    a .jsonl file with one {"seq", "timestamp", "result"} line per image.
+    Masks are stored one bit per pixel (np.packbits along each row), and
+    their lines also carry the unpacked "width". Every RECORD_SYNC_FRAMES
+    frames the images and then the metadata are synced, so every metadata
+    line on disk has its image. Images are copied into a fixed pool of
+    buffers; when every buffer is queued, the frame is dropped according to
+    RECORD_DROP.
+
+    Sharing a single core with an unpaced vision thread (the worst case),
+    mask recording costs about 6% of vision fps, against about 11% with
+    unpacked masks; benchmark_workers.py --record measures it.
+    """
+
+    def __init__(self, directory, mode=RECORD_MODE, chunk_frames=RECORD_CHUNK_FRAMES,
+                 quota_mb=RECORD_QUOTA_MB, queue_size=RECORD_QUEUE, drop=RECORD_DROP,
+                 root=RECORD_DIR, sync_frames=RECORD_SYNC_FRAMES):
+        self.directory = directory
+        self.root = root
+        self.mode = mode
+        self.chunkFrames = chunk_frames
+        self.syncFrames = sync_frames
+        self.quota = quota_mb * 1e6
+        self.drop = drop
+        # One buffer being written, one between capture and submit
+        self.poolSize = queue_size + 2
+        self.allocated = 0
+        self.free = []
+        self.lock = Lock()
+        self.queue = queue.Queue()
+        self.written = 0
+        self.dropped = 0
+        self.full = False
+        self.chunk = None
+        self.chunkIndex = 0
+        self.chunkCount = 0
+        self.meta = None
+        self.thread = None
+
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "recording.json"), "w") as f:
+            json.dump({"mode": mode, "chunk_frames": chunk_frames, "packed": mode == "mask"}, f)
+
+    def start(self):
+        self.thread = Thread(target=self.run, args=())
+        self.thread.start()
+        return self
+
+    def capture(self, image, shape=None, offset=(0, 0)):
+        """Copy image into a free buffer, or return None if the frame is dropped.
+        An image smaller than shape is pasted at offset (x, y) on black."""
+        shape = shape or image.shape
+        with self.lock:
+            if self.full:
+                return None
+            if self.free:
+                buffer = self.free.pop()
+            elif self.allocated < self.poolSize:
+                buffer = None
+                self.allocated += 1
+            elif self.drop == "oldest":
+                try:
+                    buffer = self.queue.get_nowait()[0]
+                except queue.Empty:
+                    # The writer has every buffer
+                    self.dropped += 1
+                    return None
+                self.dropped += 1
+            else:
+                self.dropped += 1
+                return None
+        if buffer is None or buffer.shape != shape or buffer.dtype != image.dtype:
+            buffer = np.empty(shape, dtype=image.dtype)
+        if image.shape == shape:
+            np.copyto(buffer, image)
+        else:
+            buffer.fill(0)
+            x, y = offset
+            buffer[y:y + image.shape[0], x:x + image.shape[1]] = image
+        return buffer
+
+    def submit(self, buffer, seq, timestamp, shuffleboard_data):
+        self.queue.put((buffer, seq, timestamp, dict(shuffleboard_data)))
+
+    def close(self):
+        self.queue.put(None)
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            buffer = item[0]
+            try:
+                self.__write(*item)
+            except OSError as err:
+                print("recording stopped: {}".format(err), file=sys.stderr)
+                self.full = True
+            with self.lock:
+                self.free.append(buffer)
+        self.__closeChunk()
+
+    def __write(self, buffer, seq, timestamp, shuffleboard_data):
+        record = {"seq": seq, "timestamp": timestamp, "result": shuffleboard_data}
+        if self.mode == "mask":
+            # 8x less to write, and replay only needs mask > 0 anyway
+            record["width"] = buffer.shape[-1]
+            buffer = np.packbits(buffer > 0, axis=-1)
+        if (self.chunk is None or self.chunkIndex == self.chunkFrames
+                or self.chunk.shape[1:] != buffer.shape or self.chunk.dtype != buffer.dtype):
+            self.__closeChunk()
+            if not self.__openChunk(buffer.shape, buffer.dtype):
+                return
+        self.chunk[self.chunkIndex] = buffer
+        self.meta.write(json.dumps(record, default=float))
+        self.meta.write("\n")
+        self.chunkIndex += 1
+        self.written += 1
+        if self.chunkIndex % self.syncFrames == 0:
+            self.__sync()
+
+    def __sync(self):
+        # Images first, so a metadata line never outlives its image
+        self.chunk.flush()
+        self.meta.flush()
+        os.fsync(self.meta.fileno())
+
+    def __openChunk(self, shape, dtype):
+        size = self.chunkFrames * int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if not self.__makeRoom(size):
+            print("recording quota of {} MB is full".format(self.quota / 1e6), file=sys.stderr)
+            self.full = True
+            return False
+        self.chunkCount += 1
+        name = os.path.join(self.directory, "chunk_{:06d}".format(self.chunkCount))
+        self.chunk = np.lib.format.open_memmap(name + ".npy", mode="w+", dtype=dtype, shape=(self.chunkFrames,) + shape)
+        self.meta = open(name + ".jsonl", "w")
+        self.chunkIndex = 0
+        return True
+
+    def __closeChunk(self):
+        if self.chunk is not None:
+            self.__sync()
+            self.chunk = None
+            self.meta.close()
+            self.meta = None
+
+    def __makeRoom(self, size):
+        """Delete the oldest chunks under root until size more bytes fit in the quota."""
+        chunks = []
+        total = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                total += stat.st_size
+                if name.startswith("chunk_") and name.endswith(".npy"):
+                    chunks.append((stat.st_mtime, path))
+        for _, path in sorted(chunks):
+            if total + size <= self.quota:
+                break
+            for victim in (path, path[:-len(".npy")] + ".jsonl"):
+                try:
+                    total -= os.path.getsize(victim)
+                    os.remove(victim)
+                except OSError:
+                    pass
+        return total + size <= self.quota
+
+
+def makeRecorder(camera=None):
+    """A started MatchRecorder for a new session under RECORD_DIR, or None."""
+    if not RECORD:
+        return None
+    # The Pi has no RTC, so the time alone may repeat across boots
+    session = "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+    if camera:
+        session += "-" + camera
+    return MatchRecorder(os.path.join(RECORD_DIR, session)).start()
 
-from threading import Thread
 
 class ThreadedVision:
-    def __init__(self, frame):
-        self.grip = VisionPipeline()
+    def __init__(self, source, roi_tracking=ROI_TRACKING, recorder=None):
+        self.grip = makePipeline(roi_tracking)
+        self.tracker = RoiTracker() if roi_tracking else None
+        self.pose = PoseEstimator() if POSE_ESTIMATION else None
+        warmUp(self.grip, self.pose)
+        self.grip.stage_timer = profiler
+        self.resolution = ResolutionController(self.grip) if DYNAMIC_RESOLUTION else None
+        self.recorder = recorder
         self.running = True
-        self.frame = frame
+        self.source = source
         self.output = None
+        # Sequence number of the frame self.output was computed from
+        self.seq = 0
+        self.dropped = 0
+        self.newResult = Condition()
+        self.thread = None
+    def start(self):
+        self.thread = Thread(target=self.run, args=())
+        self.thread.start()
+        return self
+    def stop(self):
+        """Stop and wait for the vision thread, so the source can be closed."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+    def run(self):
+        while self.running:
+            self.processFrame(timeout=0.5)
+    def processFrame(self, timeout=None):
+        """Process the newest frame if there is one we haven't seen.
+        Returns False if none arrived within timeout."""
+        # Sleep until the camera delivers a frame we haven't seen, then
+        # take the newest one and count whatever was skipped
+        lastSeq = self.seq
+        seq, timestamp, img = self.source.waitForFrame(lastSeq, timeout=timeout)
+        if seq == lastSeq:
+            return False
+        self.dropped += seq - lastSeq - 1
+
+        start = time.perf_counter()
+        scale = self.resolution.scale if self.resolution else 1.0
+        roi = self.tracker.window() if self.tracker else None
+        if roi is not None and scale != 1.0:
+            # Windows are in IMAGE_WIDTH pixels; process the same window in
+            # processing pixels, and hand the tracker back exactly that
+            roi = tuple(int(v / scale) for v in roi)
+        self.grip.process(img, roi)
+        if self.recorder:
+            recording = self.capture(img, roi)
+        self.source.release(seq)
+        output = findTarget(self.grip.filter_contours_output, self.source.toLocalTime(timestamp), scale)
+        if self.pose:
+            self.pose.update(*output)
+        if self.resolution:
+            output[1]["processing_width"] = self.resolution.width
+            self.resolution.update(time.perf_counter() - start, output[1])
+        stampResult(output[1])
+        if self.tracker:
+            contours = self.grip.filter_contours_output
+            if roi is not None and scale != 1.0:
+                contours = [(contour * scale).astype(np.float32) for contour in contours]
+                roi = tuple(v * scale for v in roi)
+            self.tracker.update(output[1], contours, roi)
+        if self.recorder and recording is not None:
+            self.recorder.submit(recording, seq, timestamp, output[1])
+        if profiler:
+            profiler.lap("vision.total", start)
+
+        with self.newResult:
+            self.output = output
+            self.seq = seq
+            self.newResult.notify_all()
+        return True
+    def capture(self, img, roi):
+        """Hand this frame's image to the recorder before its buffer is released."""
+        if self.recorder.mode == "frame":
+            return self.recorder.capture(img)
+        grip = self.grip
+        mask = grip.rgb_threshold_output if grip.resize_first else grip.resize_image_output
+        # Masks of a processing window are pasted into a full-size one
+        width = self.resolution.width if self.resolution else IMAGE_WIDTH
+        shape = (width * IMAGE_HEIGHT // IMAGE_WIDTH, width)
+        return self.recorder.capture(mask, shape, roi[:2] if roi else (0, 0))
+    def waitForResult(self, lastSeq, timeout=None):
+        """Block until there is a result newer than lastSeq.
+        Returns (seq, output); seq is still lastSeq if the wait timed out."""
+        with self.newResult:
+            self.newResult.wait_for(lambda: self.seq > lastSeq, timeout)
+            return self.seq, self.output
+
+# How much more CPU the camera selected in active_camera gets than its priority says
+ACTIVE_CAMERA_BOOST = 4
+
+
+class MultiCameraVision:
+    """One ThreadedVision per camera, all run from a single scheduler thread.
+
+    Cameras with a new frame are served by stride scheduling: each camera's
+    weight is its configured priority, times ACTIVE_CAMERA_BOOST for the
+    camera named in the active_camera NetworkTables entry, so CPU splits in
+    proportion to weight. A camera with priority 0 is only processed while
+    it is active.
+    """
+
+    def __init__(self, cameras, activeEntry):
+        """cameras is a list of (name, ThreadedInput, priority)."""
+        self.names = [name for name, _, _ in cameras]
+        self.visions = {
+            name: ThreadedVision(source, recorder=makeRecorder(name)) for name, source, _ in cameras
+        }
+        self.priority = {name: priority for name, _, priority in cameras}
+        self.passes = {name: 0.0 for name in self.names}
+        self.activeEntry = activeEntry
+        self.active = self.names[0]
+        self.activeEntry.setDefaultString(self.active)
+        self.running = True
+        self.results = 0
+        self.newResult = Condition()
     def start(self):
         Thread(target=self.run, args=()).start()
         return self
+    def weight(self, name):
+        if name == self.active:
+            return max(self.priority[name], 1) * ACTIVE_CAMERA_BOOST
+        return self.priority[name]
     def run(self):
         while self.running:
-            frame = self.frame.copy()
-            self.grip.process(frame)
-            frame = cv2.resize(frame, (320, 240), 0, 0, cv2.INTER_CUBIC)
-            self.output = angleToTarget(frame, self.grip.filter_contours_output)
+            active = self.activeEntry.getString(self.active)
+            if active in self.visions:
+                self.active = active
+
+            ready = [
+                name
+                for name in self.names
+                if self.weight(name) > 0 and self.visions[name].source.seq > self.visions[name].seq
+            ]
+            if not ready:
+                time.sleep(0.002)
+                continue
+            # A camera that sat idle doesn't get to catch up in a burst
+            floor = min(self.passes[name] for name in ready)
+            name = min(ready, key=lambda n: max(self.passes[n], floor))
+            self.passes[name] = max(self.passes[name], floor) + 1.0 / self.weight(name)
+
+            if self.visions[name].processFrame(timeout=0):
+                with self.newResult:
+                    self.results += 1
+                    self.newResult.notify_all()
+    def waitForResults(self, lastCount, timeout=None):
+        """Block until any camera has a new result. Returns the new result count."""
+        with self.newResult:
+            self.newResult.wait_for(lambda: self.results > lastCount, timeout)
+            return self.results
 
 image_width = 640
 image_height = 480
 
+# Capture buffers; the camera writes one while vision and the stream read others
+RING_SIZE = 4
+
+# Dashboard stream size and frame rate cap
+STREAM_WIDTH = 160
+STREAM_HEIGHT = 120
+STREAM_FPS = 15
+
+# Field bandwidth for the dashboard stream in Mbps. When set, we encode and
+# serve the MJPEG stream ourselves on STREAM_PORT and adapt resolution, JPEG
+# quality and frame rate to stay under it; None uses cscore's fixed stream.
+STREAM_BUDGET_MBPS = 2.0
+STREAM_PORT = 1182
+# (width, height, JPEG quality, fps), best first
+STREAM_LEVELS = [
+    (320, 240, 60, 30),
+    (320, 240, 40, 20),
+    (160, 120, 60, 30),
+    (160, 120, 40, 20),
+    (160, 120, 25, 15),
+    (80, 60, 25, 10),
+]
+
 class ThreadedInput:
-    def __init__(self, cvSink):
-        self.img = np.zeros(shape=(image_height, image_width, 3), dtype=np.uint8)
+    def __init__(self, cvSink, size=RING_SIZE, shared=False):
+        self.shared = shared
+        if shared:
+            # Worker processes attach to these blocks by name
+            from multiprocessing import shared_memory
+
+            self.blocks = [
+                shared_memory.SharedMemory(create=True, size=image_height * image_width * 3)
+                for _ in range(size)
+            ]
+            self.slotNames = [block.name for block in self.blocks]
+            self.slots = [
+                np.ndarray((image_height, image_width, 3), dtype=np.uint8, buffer=block.buf)
+                for block in self.blocks
+            ]
+        else:
+            self.blocks = []
+            self.slotNames = []
+            self.slots = [np.zeros(shape=(image_height, image_width, 3), dtype=np.uint8) for _ in range(size)]
+        self.slotSeq = [0] * size
+        self.slotTimestamp = [0] * size
+        # Number of readers holding each slot; pinned slots are never written
+        self.pinned = [0] * size
+        self.latest = 0
         self.cvSink = cvSink
         self.timestamp = 0
+        self.error = ""
+        # Incremented once per new camera frame
+        self.seq = 0
+        self.duplicates = 0
+        # time.monotonic() minus cscore time, from the frame that arrived fastest
+        self.clockOffset = None
+        self.newFrame = Condition()
+        self.running = True
+        self.thread = None
     def start(self):
-        Thread(target=self.run, args=()).start()
+        self.thread = Thread(target=self.run, args=())
+        self.thread.start()
         return self
     def run(self):
-        while True:
-            self.timestamp, self.img = self.cvSink.grabFrame(self.img) 
+        slot = 1
+        while self.running:
+            if profiler:
+                t = time.perf_counter()
+            timestamp, img = self.cvSink.grabFrame(self.slots[slot])
+            if profiler:
+                profiler.lap("capture", t)
+            if timestamp == 0:
+                self.error = self.cvSink.getError()
+                self.timestamp = 0
+                continue
+            if timestamp == self.timestamp:
+                self.duplicates += 1
+                continue
+            # A frame can't arrive before it was captured, so the smallest
+            # difference seen is the best estimate of the clock offset
+            offset = time.monotonic() - timestamp / 1e6
+            if self.clockOffset is None or offset < self.clockOffset:
+                self.clockOffset = offset
+            if self.seq == 0:
+                startup.mark("first_frame")
+            with self.newFrame:
+                # grabFrame only allocates if the camera mode doesn't match
+                if img is not self.slots[slot]:
+                    if self.shared:
+                        np.copyto(self.slots[slot], img)
+                    else:
+                        self.slots[slot] = img
+                self.seq += 1
+                self.slotSeq[slot] = self.seq
+                self.slotTimestamp[slot] = timestamp
+                self.timestamp = timestamp
+                self.latest = slot
+                self.newFrame.notify_all()
+                slot = self.__nextFreeSlot()
+    def __nextFreeSlot(self):
+        size = len(self.slots)
+        for i in range(1, size):
+            slot = (self.latest + i) % size
+            if self.pinned[slot] == 0:
+                return slot
+        raise RuntimeError("every capture buffer is held by a reader")
+    def waitForFrame(self, lastSeq, timeout=None):
+        """Block until a frame newer than lastSeq has been captured.
+        Returns (seq, timestamp, img), where img is a read-only view of the
+        capture buffer that stays valid until release(seq) is called. seq is
+        still lastSeq (and nothing is held) if the wait timed out."""
+        with self.newFrame:
+            if not self.newFrame.wait_for(lambda: self.seq > lastSeq, timeout):
+                return lastSeq, self.timestamp, None
+            slot = self.latest
+            self.pinned[slot] += 1
+            view = self.slots[slot].view()
+            view.flags.writeable = False
+            return self.slotSeq[slot], self.slotTimestamp[slot], view
+    def release(self, seq):
+        """Give back the buffer returned by waitForFrame."""
+        with self.newFrame:
+            slot = self.slotSeq.index(seq)
+            self.pinned[slot] -= 1
+    def toLocalTime(self, timestamp):
+        """Convert a cscore frame timestamp (microseconds) to time.monotonic() seconds."""
+        return timestamp / 1e6 + (self.clockOffset or 0.0)
+    def slotOf(self, seq):
+        """Index of the buffer holding frame seq; only valid while it is held."""
+        with self.newFrame:
+            return self.slotSeq.index(seq)
+    def close(self):
+        """Stop capturing and free the buffers. Readers (ThreadedVision,
+        ProcessVision) must be stopped first; their frames go with the buffers."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        # Views into shared memory have to go before the blocks can be closed
+        self.slots = []
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def visionWorker(index, slotNames, tasks, results):
+    """Body of a ProcessVision worker: runs the pipeline on shared capture buffers."""
+    from multiprocessing import shared_memory
+
+    blocks = [shared_memory.SharedMemory(name=name) for name in slotNames]
+    slots = [
+        np.ndarray((image_height, image_width, 3), dtype=np.uint8, buffer=block.buf)
+        for block in blocks
+    ]
+    grip = makePipeline()
+    pose = PoseEstimator() if POSE_ESTIMATION else None
+    warmUp(grip, pose)
+    grip.stage_timer = profiler
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        seq, slot, captureTime = task
+        img = slots[slot]
+        grip.process(img)
+        output = findTarget(grip.filter_contours_output, captureTime)
+        if pose:
+            pose.update(*output)
+        stampResult(output[1])
+        results.put((index, seq, output))
+    del img, slots
+    for block in blocks:
+        block.close()
+
+
+class ProcessVision:
+    """Same interface as ThreadedVision, but frames are processed by a pool of
+    worker processes so the pipeline isn't serialized by the GIL.
+
+    Frames go to idle workers in round robin straight from the shared capture
+    buffers, and results are published in frame order. ROI tracking needs the
+    previous frame's result, so it isn't available here.
+    """
+
+    def __init__(self, source, workers=VISION_WORKERS):
+        context = multiprocessing.get_context("spawn")
+        self.source = source
+        self.running = True
+        self.output = None
+        self.seq = 0
+        self.dropped = 0
+        self.newResult = Condition()
+        # Sequence number each worker is busy with, or None if idle
+        self.inflight = [None] * workers
+        self.idle = Condition()
+        self.threads = []
+        self.results = context.Queue()
+        self.tasks = [context.Queue() for _ in range(workers)]
+        self.workers = [
+            context.Process(
+                target=visionWorker,
+                args=(i, source.slotNames, self.tasks[i], self.results),
+                daemon=True,
+            )
+            for i in range(workers)
+        ]
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        self.threads = [Thread(target=self.collect, args=()), Thread(target=self.run, args=())]
+        for thread in self.threads:
+            thread.start()
+        return self
+    def stop(self):
+        """Stop the threads and workers, so the source can be closed."""
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        for tasks in self.tasks:
+            tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+    def run(self):
+        lastSeq = 0
+        nextWorker = 0
+        numWorkers = len(self.workers)
+        while self.running:
+            # Only take a frame once someone can work on it, so it's the newest
+            with self.idle:
+                if not self.idle.wait_for(lambda: None in self.inflight, 0.5):
+                    continue
+            seq, timestamp, img = self.source.waitForFrame(lastSeq, timeout=0.5)
+            if seq == lastSeq:
+                continue
+            self.dropped += seq - lastSeq - 1
+            lastSeq = seq
+
+            with self.idle:
+                for i in range(numWorkers):
+                    worker = (nextWorker + i) % numWorkers
+                    if self.inflight[worker] is None:
+                        break
+                self.inflight[worker] = seq
+                nextWorker = (worker + 1) % numWorkers
+            self.tasks[worker].put((seq, self.source.slotOf(seq), self.source.toLocalTime(timestamp)))
+    def collect(self):
+        pending = []
+        while self.running:
+            try:
+                worker, seq, output = self.results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self.source.release(seq)
+            with self.idle:
+                self.inflight[worker] = None
+                heapq.heappush(pending, (seq, output))
+                busy = [s for s in self.inflight if s is not None]
+                self.idle.notify_all()
+            # Hold results back until every older frame has come back
+            oldest = min(busy) if busy else None
+            while pending and (oldest is None or pending[0][0] < oldest):
+                seq, output = heapq.heappop(pending)
+                with self.newResult:
+                    self.output = output
+                    self.seq = seq
+                    self.newResult.notify_all()
+    def waitForResult(self, lastSeq, timeout=None):
+        """Block until there is a result newer than lastSeq.
+        Returns (seq, output); seq is still lastSeq if the wait timed out."""
+        with self.newResult:
+            self.newResult.wait_for(lambda: self.seq > lastSeq, timeout)
+            return self.seq, self.output
+
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import socket
+import socketserver
+
+StreamMode = namedtuple("StreamMode", ["width", "height", "fps"])
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer, which needs Python 3.7."""
+
+
+class MjpegHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        encoder = self.server.encoder
+        self.send_response(200)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        self.end_headers()
+        encoder.addClient(1)
+        try:
+            seq = 0
+            while encoder.running:
+                seq, jpeg = encoder.waitForJpeg(seq, timeout=1.0)
+                if jpeg is None:
+                    continue
+                self.wfile.write(
+                    b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpeg)
+                )
+                self.wfile.write(jpeg)
+                self.wfile.write(b"\r\n")
+                encoder.countSent(len(jpeg))
+        except (BrokenPipeError, ConnectionResetError):
             pass
+        finally:
+            encoder.addClient(-1)
 
-def main():
-    global configFile
+    def log_message(self, format, *args):
+        pass
 
-    if len(sys.argv) >= 2:
-        configFile = sys.argv[1]
 
-    if not readConfig():
-        print("Unable to read config file!")
-        sys.exit(1)
+class AdaptiveStreamEncoder:
+    """MJPEG stream that keeps the bytes actually sent under a bandwidth budget.
 
-    # start cameras
-    streams = []
+    Looks like a cscore CvSource to StreamThread (putFrame, isEnabled,
+    notifyError, getVideoMode). Frames are JPEG-encoded on their own thread,
+    latest-wins, and served over HTTP. Once a second the measured rate picks a
+    step on STREAM_LEVELS: down as soon as we are over budget, up after a few
+    seconds comfortably under it.
+    """
 
-    print("Initialized vision stuff")
+    def __init__(self, budgetMbps=STREAM_BUDGET_MBPS, port=STREAM_PORT, levels=STREAM_LEVELS):
+        self.budget = budgetMbps * 1e6 / 8
+        self.port = port
+        self.levels = levels
+        self.level = len(levels) // 2
+        self.lastChange = time.monotonic()
+        self.running = True
+        self.error = ""
+
+        self.frame = None
+        self.newFrame = Condition()
+        self.jpeg = None
+        self.jpegSeq = 0
+        self.newJpeg = Condition()
+
+        self.clients = 0
+        self.sent = 0
+        self.encodeTime = 0.0
+        self.encoded = 0
+        self.windowStart = time.monotonic()
+        # Measured over the last full second
+        self.bytesPerSec = 0.0
+        self.encodeMs = 0.0
+    def start(self):
+        self.server = ThreadingHTTPServer(("", self.port), MjpegHandler)
+        self.server.daemon_threads = True
+        self.server.encoder = self
+        Thread(target=self.server.serve_forever, args=()).start()
+        Thread(target=self.run, args=()).start()
+        return self
+    def url(self):
+        return "mjpg:http://{}.local:{}/stream.mjpg".format(socket.gethostname(), self.port)
+
+    # CvSource interface
+    def getVideoMode(self):
+        width, height, quality, fps = self.levels[self.level]
+        return StreamMode(width, height, fps)
+    def isEnabled(self):
+        return self.clients > 0
+    def notifyError(self, msg):
+        self.error = msg
+    def putFrame(self, frame):
+        with self.newFrame:
+            self.frame = frame
+            self.newFrame.notify_all()
+
+    def addClient(self, delta):
+        with self.newJpeg:
+            self.clients += delta
+    def countSent(self, nbytes):
+        with self.newJpeg:
+            self.sent += nbytes
+    def waitForJpeg(self, lastSeq, timeout=None):
+        with self.newJpeg:
+            if not self.newJpeg.wait_for(lambda: self.jpegSeq > lastSeq, timeout):
+                return lastSeq, None
+            return self.jpegSeq, self.jpeg
+    def run(self):
+        while self.running:
+            with self.newFrame:
+                if not self.newFrame.wait_for(lambda: self.frame is not None, 0.5):
+                    self.adjust()
+                    continue
+                frame, self.frame = self.frame, None
+
+            width, height, quality, fps = self.levels[self.level]
+            start = time.perf_counter()
+            if frame.shape[1] != width:
+                frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            self.encodeTime += time.perf_counter() - start
+            self.encoded += 1
+            if ok:
+                with self.newJpeg:
+                    self.jpeg = jpeg.tobytes()
+                    self.jpegSeq += 1
+                    self.newJpeg.notify_all()
+            self.adjust()
+    def adjust(self):
+        now = time.monotonic()
+        elapsed = now - self.windowStart
+        if elapsed < 1.0:
+            return
+        with self.newJpeg:
+            sent, self.sent = self.sent, 0
+        self.bytesPerSec = sent / elapsed
+        self.encodeMs = 1000 * self.encodeTime / self.encoded if self.encoded else 0.0
+        self.encodeTime = 0.0
+        self.encoded = 0
+        self.windowStart = now
+
+        if self.bytesPerSec > self.budget and self.level < len(self.levels) - 1:
+            self.level += 1
+            self.lastChange = now
+        elif (
+            self.bytesPerSec < 0.6 * self.budget
+            and self.level > 0
+            and self.clients > 0
+            and now - self.lastChange > 3.0
+        ):
+            self.level -= 1
+            self.lastChange = now
+
+
+class StreamThread:
+    """Feeds the dashboard stream off the vision critical path.
+
+    Takes the newest camera frame, shrinks it straight to the stream size and
+    draws the latest vision result on it with scaled coordinates, at most
+    STREAM_FPS times a second, and only while a client is connected. The
+    stream's video mode is read every frame, so an adaptive stream can
+    change size and rate under us; its level sets the rate, not STREAM_FPS.
+    """
 
-    for cameraConfig in cameraConfigs:
-        # cameras.append(startCamera(cameraConfig))
-        cs, cameraCapture = startCamera(cameraConfig)
-        streams.append(cs)
+    def __init__(self, source, vision, outputStream, fps=None):
+        self.source = source
+        self.vision = vision
+        self.outputStream = outputStream
+        if fps is None and not isinstance(outputStream, AdaptiveStreamEncoder):
+            fps = STREAM_FPS
+        # None follows the video mode's rate
+        self.maxFps = fps
+        self.running = True
+    def start(self):
+        Thread(target=self.run, args=()).start()
+        return self
+    def run(self):
+        lastSeq = 0
+        lastSource = None
+        while self.running:
+            # cscore only enables a CvSource while a sink (the MJPEG server
+            # with a connected client) is pulling from it
+            if not self.outputStream.isEnabled():
+                time.sleep(0.5)
+                continue
+            start = time.monotonic()
+            # Multi-camera mode swaps these when the active camera changes
+            source, vision = self.source, self.vision
+            if source is not lastSource:
+                lastSeq = 0
+                lastSource = source
+            seq, timestamp, img = source.waitForFrame(lastSeq, timeout=0.5)
+            if seq == lastSeq:
+                if source.timestamp == 0:
+                    self.outputStream.notifyError(source.error)
+                continue
+            lastSeq = seq
+            if profiler:
+                t = time.perf_counter()
+            mode = self.outputStream.getVideoMode()
+            frame = cv2.resize(img, (mode.width, mode.height), interpolation=cv2.INTER_AREA)
+            source.release(seq)
+
+            output = vision.output
+            if output is not None:
+                targetContours, shuffleboard_data = output
+                drawTarget(frame, targetContours, shuffleboard_data, mode.width / IMAGE_WIDTH)
+            self.outputStream.putFrame(frame)
+            if profiler:
+                profiler.lap("stream", t)
+            if self.maxFps is None:
+                fps = mode.fps
+            else:
+                fps = min(mode.fps or self.maxFps, self.maxFps)
+            period = 1.0 / fps
+            time.sleep(max(period - (time.monotonic() - start), 0))
 
-    # First camera is server
-    cameraServer = streams[0]
 
-    # Set up a CV Sink to capture video
-    cvSink = cameraServer.getVideo()
+def main():
+    global configFile
+    global server
 
-    # CvSource
-    outputStream = cameraServer.putVideo("stream", image_width, image_height)
+    # frc2554_vision_final.py --replay <videos, image dirs or recordings>
+    # runs on footage instead of cameras, as its own NetworkTables server
+    replay = None
+    if len(sys.argv) >= 3 and sys.argv[1] == "--replay":
+        replay = sys.argv[2:]
+    elif len(sys.argv) >= 2:
+        configFile = sys.argv[1]
 
-    img = np.zeros(shape=(image_height, image_width, 3), dtype=np.uint8)
+    startup.mark("imports")
 
-    # Networktables
+    if replay:
+        server = True
+    elif not readConfig():
+        print("Unable to read config file!")
+        sys.exit(1)
+    startup.mark("config")
+
+    # NetworkTables connects in the background while the cameras negotiate
     ninst = NetworkTablesInstance.getDefault()
+
+    def connectionChanged(connected, info):
+        if connected:
+            startup.mark("nt_connected")
+
+    ninst.addConnectionListener(connectionChanged, immediateNotify=True)
     if server:
         print("Setting up NetworkTables server")
         ninst.startServer()
@@ -560,40 +2406,182 @@ def main():
 
     network_table = ninst.getTable("Shuffleboard").getSubTable("Vision")
     network_table.getEntry("connected").setValue(True)
+    startup.mark("nt_started")
 
-    imgetter = ThreadedInput(cvSink).start()
-    timestamp, img = imgetter.timestamp, imgetter.img
-    vis = ThreadedVision(img).start()
-    
-    time.sleep(0.1)
+    # start cameras
+    streams = []
+    cameras = []
 
-    num_frames = 0
+    print("Initialized vision stuff")
 
-    while True:
-        start = time.time()
-        num_frames += 1
-        start = time.time()
-        timestamp, img = imgetter.timestamp, imgetter.img
-        vis.frame = img
+    if replay:
+        from replay import ReplaySink
 
-        if timestamp == 0:
-            outputStream.notifyError(cvSink.getError())
-            continue
+        # Paced, so frames arrive at the rate they were recorded like a camera's
+        cvSinks = [ReplaySink(replay, paced=True)]
+    else:
+        for cameraConfig in cameraConfigs:
+            # cameras.append(startCamera(cameraConfig))
+            cs, cameraCapture = startCamera(cameraConfig)
+            streams.append(cs)
+            cameras.append(cameraCapture)
+
+        # First camera is server
+        cameraServer = streams[0]
+
+        # Set up a CV Sink to capture video from each camera
+        cvSinks = [cs.getVideo(camera=camera) for cs, camera in zip(streams, cameras)]
+    startup.mark("cameras_started")
+
+    # CvSource; without cscore there is only our own MJPEG server
+    if STREAM_BUDGET_MBPS or replay:
+        outputStream = AdaptiveStreamEncoder().start()
+    else:
+        outputStream = cameraServer.putVideo("stream", STREAM_WIDTH, STREAM_HEIGHT)
+
+    if STREAM_BUDGET_MBPS or replay:
+        # Same place cscore advertises its streams, so dashboards find ours
+        ninst.getTable("CameraPublisher").getSubTable("stream").getEntry("streams").setStringArray(
+            [outputStream.url()]
+        )
+
+    clock = ServerClock(network_table)
+    publisher = VisionPublisher(ninst, network_table)
+
+    def prepareResult(shuffleboard_data, seq, vis, imgetter):
+        startup.result(shuffleboard_data, network_table)
+        shuffleboard_data = dict(shuffleboard_data)
+        shuffleboard_data["frame_seq"] = seq
+        shuffleboard_data["capture_time"] = clock.toServer(shuffleboard_data["capture_time"])
+        shuffleboard_data["processed_time"] = clock.toServer(shuffleboard_data["processed_time"])
+        shuffleboard_data["clock_synced"] = clock.synced
+        shuffleboard_data["dropped_frames"] = vis.dropped
+        shuffleboard_data["duplicate_frames"] = imgetter.duplicates
+        if STREAM_BUDGET_MBPS or replay:
+            shuffleboard_data["stream_kbps"] = outputStream.bytesPerSec * 8 / 1000
+            shuffleboard_data["stream_encode_ms"] = outputStream.encodeMs
+            shuffleboard_data["stream_level"] = outputStream.level
+        return shuffleboard_data
+
+    if len(cvSinks) > 1:
+        runMultiCamera(ninst, network_table, cvSinks, outputStream, clock, publisher, prepareResult)
+        return
+
+    if VISION_WORKERS > 0:
+        imgetter = ThreadedInput(cvSinks[0], size=max(RING_SIZE, VISION_WORKERS + 3), shared=True).start()
+        vis = ProcessVision(imgetter, VISION_WORKERS).start()
+    else:
+        imgetter = ThreadedInput(cvSinks[0]).start()
+        vis = ThreadedVision(imgetter, recorder=makeRecorder()).start()
+    startup.mark("vision_started")
+    StreamThread(imgetter, vis, outputStream).start()
 
-        new_image, shuffleboard_data = vis.output
+    # Predicted results go to Shuffleboard/Vision/track at TRACK_RATE
+    tracker = TargetTracker() if TRACKING else None
+    trackPublisher = VisionPublisher(ninst, network_table.getSubTable("track")) if TRACKING else None
+    nextTick = time.monotonic()
 
-        for name, data in shuffleboard_data.items():
-           network_table.getEntry(name).setValue(data)
+    num_frames = 0
+    lastSeq = 0
+    start = time.time()
 
-        new_image = cv2.resize(new_image, (160, 120))
+    while True:
+        timeout = max(nextTick - time.monotonic(), 0) if tracker else 0.5
+        seq, output = vis.waitForResult(lastSeq, timeout=timeout)
+        published = False
+        if seq != lastSeq:
+            lastSeq = seq
+            num_frames += 1
+
+            targetContours, shuffleboard_data = output
+
+            clock.update()
+            publisher.publish(prepareResult(shuffleboard_data, seq, vis, imgetter))
+            published = True
+            if tracker:
+                tracker.update(shuffleboard_data)
+
+            if num_frames % 1000 == 0:
+                fps = num_frames / (time.time() - start)
+                print(fps, "dropped:", vis.dropped, "duplicates:", imgetter.duplicates)
+                if profiler:
+                    profiler.printReport()
+                    profiler.writeTrace(PROFILE_TRACE)
+                num_frames = 0
+                start = time.time()
+
+        if tracker and time.monotonic() >= nextTick:
+            now = time.monotonic()
+            track = tracker.output(now)
+            track["track_time"] = clock.toServer(now)
+            trackPublisher.publish(track)
+            published = True
+            nextTick = max(nextTick + 1.0 / TRACK_RATE, now)
+
+        # One flush for everything written this iteration
+        if published:
+            ninst.flush()
+
+
+def runMultiCamera(ninst, network_table, cvSinks, outputStream, clock, publisher, prepareResult):
+    """Main loop when more than one camera is configured.
+
+    Each camera publishes under Shuffleboard/Vision/<camera name>; the camera
+    named in Shuffleboard/Vision/active_camera also publishes to
+    Shuffleboard/Vision itself, so robot code reading one camera keeps working.
+    """
+    names = [config.name for config in cameraConfigs]
+    inputs = {name: ThreadedInput(cvSink).start() for name, cvSink in zip(names, cvSinks)}
+    vis = MultiCameraVision(
+        [(config.name, inputs[config.name], config.priority) for config in cameraConfigs],
+        network_table.getEntry("active_camera"),
+    ).start()
+    startup.mark("vision_started")
+    stream = StreamThread(inputs[vis.active], vis.visions[vis.active], outputStream).start()
+
+    publishers = {name: VisionPublisher(ninst, network_table.getSubTable(name)) for name in names}
+    lastSeq = {name: 0 for name in names}
+    counts = {name: 0 for name in names}
+    fps = {name: 0.0 for name in names}
+    lastCount = 0
+    start = time.time()
 
-        outputStream.putFrame(new_image)
+    while True:
+        lastCount = vis.waitForResults(lastCount, timeout=0.5)
+        clock.update()
+
+        if stream.source is not inputs[vis.active]:
+            stream.source, stream.vision = inputs[vis.active], vis.visions[vis.active]
+
+        published = False
+        for name in names:
+            camera = vis.visions[name]
+            # Under the lock so seq and output come from the same frame
+            with camera.newResult:
+                seq, output = camera.seq, camera.output
+            if seq == lastSeq[name]:
+                continue
+            lastSeq[name] = seq
+            counts[name] += 1
+
+            shuffleboard_data = prepareResult(output[1], seq, camera, inputs[name])
+            shuffleboard_data["fps"] = fps[name]
+            publishers[name].publish(shuffleboard_data)
+            if name == vis.active:
+                shuffleboard_data["camera"] = name
+                publisher.publish(shuffleboard_data)
+            published = True
+        # One flush for every camera, after all of them have written
+        if published:
+            ninst.flush()
+
+        elapsed = time.time() - start
+        if elapsed >= 1.0:
+            for name in names:
+                fps[name] = counts[name] / elapsed
+                counts[name] = 0
+            start = time.time()
 
-        fps = 1 / (time.time() - start)
-        if num_frames % 1000 == 0:
-            print(fps)
-            num_frames = 0
-        time.sleep(max(1.0 / 30.0 - (time.time() - start), 0))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+# Runs a GRIP .grip pipeline directly instead of pasting generated code.
+#
+#   grip = GripPipeline.load("GRIP_Files/Final420.grip")
+#   grip.process(frame)
+#   grip.filter_contours_output
+#
+# The step list is compiled once into a flat list of bound calls, each
+# reading its inputs by index from the previous steps' outputs, and steps
+# that produce images write into buffers reused from frame to frame.
+# Parameters are changed by compiling a new program and swapping it in with
+# one assignment, so a frame never sees half of an update.
+
+import time
+import xml.etree.ElementTree as ET
+
+import cv2
+import numpy as np
+
+INTERPOLATIONS = {
+    "NONE": cv2.INTER_NEAREST,
+    "LINEAR": cv2.INTER_LINEAR,
+    "CUBIC": cv2.INTER_CUBIC,
+    "LANCZOS": cv2.INTER_LANCZOS4,
+    "AREA": cv2.INTER_AREA,
+}
+
+
+def parseValue(element):
+    """The Python value of an InputSocketImpl <value> element."""
+    items = list(element)
+    if items:
+        return [int(item.text) if item.tag == "int" else float(item.text) for item in items]
+    text = (element.text or "").strip()
+    if text in ("true", "false"):
+        return text == "true"
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def parseGrip(path):
+    """Steps of a .grip file as a list of (name, {socket: value}, {socket: input ref}).
+
+    An input ref is ("source", n) for the nth pipeline source or
+    ("step", n) for the output of step n.
+    """
+    root = ET.parse(path).getroot()
+    steps = []
+    for step in root.find("steps"):
+        params = {}
+        for socket in step.findall("edu.wpi.grip.core.sockets.InputSocketImpl"):
+            value = socket.find("value")
+            if value is not None:
+                params[int(socket.get("socket"))] = parseValue(value)
+        steps.append((step.get("name"), params, {}))
+
+    for connection in root.find("connections"):
+        output = connection.find("edu.wpi.grip.core.sockets.OutputSocketImpl")
+        input = connection.find("edu.wpi.grip.core.sockets.InputSocketImpl")
+        if output.get("socket") != "0":
+            raise ValueError("only the first output of a step can be connected")
+        if output.get("source") is not None:
+            ref = ("source", int(output.get("source")))
+        else:
+            ref = ("step", int(output.get("step")))
+        steps[int(input.get("step"))][2][int(input.get("socket"))] = ref
+    return steps
+
+
+class Buffer:
+    """An output image reused for as long as the input keeps its shape."""
+
+    def __init__(self):
+        self.array = None
+
+    def get(self, shape, dtype=np.uint8):
+        if self.array is None or self.array.shape != shape:
+            self.array = np.empty(shape, dtype=dtype)
+        return self.array
+
+
+def inRangeBounds(ranges):
+    """(lower, upper) inRange bounds for GRIP (low, high) ranges, one per channel."""
+    lower = []
+    upper = []
+    for low, high in ranges:
+        # cv2.inRange rounds fractional bounds to the nearest integer
+        low = max(int(round(low)), 0)
+        high = min(int(round(high)), 255)
+        if low > high:
+            # An empty range matches nothing
+            low, high = 255, 0
+        lower.append(low)
+        upper.append(high)
+    return np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8)
+
+
+def rgbThreshold(params):
+    red, green, blue = params[1], params[2], params[3]
+    # Frames are BGR, so no channel swap is needed
+    lower, upper = inRangeBounds((blue, green, red))
+    output = Buffer()
+
+    def run(input):
+        return cv2.inRange(input, lower, upper, dst=output.get(input.shape[:2]))
+    return run
+
+
+def hsvThreshold(params):
+    hue, saturation, value = params[1], params[2], params[3]
+    lower, upper = inRangeBounds((hue, saturation, value))
+    hsv = Buffer()
+    output = Buffer()
+
+    def run(input):
+        converted = cv2.cvtColor(input, cv2.COLOR_BGR2HSV, dst=hsv.get(input.shape))
+        return cv2.inRange(converted, lower, upper, dst=output.get(input.shape[:2]))
+    return run
+
+
+def resizeImage(params):
+    size = (int(params[1]), int(params[2]))
+    interpolation = INTERPOLATIONS[params[3]]
+    output = Buffer()
+
+    def run(input):
+        dst = output.get((size[1], size[0]) + input.shape[2:], input.dtype)
+        return cv2.resize(input, size, dst=dst, interpolation=interpolation)
+    return run
+
+
+def findContours(params):
+    mode = cv2.RETR_EXTERNAL if params[1] else cv2.RETR_LIST
+
+    def run(input):
+        return cv2.findContours(input, mode=mode, method=cv2.CHAIN_APPROX_SIMPLE)[-2]
+    return run
+
+
+def convexHulls(params):
+    def run(input):
+        return [cv2.convexHull(contour) for contour in input]
+    return run
+
+
+def filterContours(params):
+    (min_area, min_perimeter, min_width, max_width, min_height, max_height, solidity,
+     max_vertex_count, min_vertex_count, min_ratio, max_ratio) = [params[i] for i in range(1, 12)]
+
+    def run(input):
+        if len(input) == 0:
+            return []
+        rects = np.array([cv2.boundingRect(contour) for contour in input]).reshape(-1, 4)
+        w = rects[:, 2]
+        h = rects[:, 3]
+        vertices = np.array([len(contour) for contour in input])
+        area = np.array([cv2.contourArea(contour) for contour in input])
+        keep = ((w >= min_width) & (w <= max_width)
+                & (h >= min_height) & (h <= max_height)
+                & (area >= min_area)
+                & (vertices >= min_vertex_count) & (vertices <= max_vertex_count))
+        ratio = w / h.astype(float)
+        keep &= (ratio >= min_ratio) & (ratio <= max_ratio)
+        if min_perimeter > 0:
+            for i in np.flatnonzero(keep):
+                keep[i] = cv2.arcLength(input[i], True) >= min_perimeter
+        if solidity[0] > 0 or solidity[1] < 100:
+            for i in np.flatnonzero(keep):
+                solid = 100 * area[i] / cv2.contourArea(cv2.convexHull(input[i]))
+                keep[i] = solidity[0] <= solid <= solidity[1]
+        return [input[i] for i in np.flatnonzero(keep)]
+    return run
+
+
+# GRIP step name -> stage name in profiles, the same as VisionPipeline's
+STAGES = {
+    "RGB Threshold": "threshold",
+    "HSV Threshold": "threshold",
+    "Resize Image": "resize",
+    "Find Contours": "find_contours",
+    "Convex Hulls": "hulls",
+    "Filter Contours": "filter",
+}
+
+# GRIP step name -> factory taking {socket: value} and returning the bound call
+OPERATIONS = {
+    "RGB Threshold": rgbThreshold,
+    "HSV Threshold": hsvThreshold,
+    "Resize Image": resizeImage,
+    "Find Contours": findContours,
+    "Convex Hulls": convexHulls,
+    "Filter Contours": filterContours,
+}
+
+
+class GripPipeline:
+    """A .grip pipeline with the same interface as a GRIP-generated VisionPipeline:
+    process(source0), then read <step name>_output attributes."""
+
+    # Read by tools written against VisionPipeline
+    resize_first = False
+
+    def __init__(self, steps):
+        for name, _, _ in steps:
+            if name not in OPERATIONS:
+                raise ValueError("unsupported GRIP step: {}".format(name))
+        self.steps = steps
+        self.names = {}
+        for index, (name, _, _) in enumerate(steps):
+            attribute = name.lower().replace(" ", "_") + "_output"
+            if attribute in self.names:
+                attribute = "{}{}_output".format(attribute[:-len("_output")], index)
+            # values[0] is the source, step n's output is values[n + 1]
+            self.names[attribute] = index + 1
+        self.values = [None] * (len(steps) + 1)
+        # Optional object with lap(name, start) -> now, called after every step
+        self.stage_timer = None
+        self.program = self.compile(steps)
+
+    @classmethod
+    def load(cls, path):
+        return cls(parseGrip(path))
+
+    @staticmethod
+    def compile(steps):
+        program = []
+        for index, (name, params, inputs) in enumerate(steps):
+            refs = []
+            for socket in sorted(inputs):
+                kind, n = inputs[socket]
+                if kind == "source" and n != 0:
+                    raise ValueError("only one source is supported")
+                refs.append(0 if kind == "source" else n + 1)
+            stage = "pipeline." + STAGES[name]
+            program.append((OPERATIONS[name](params), tuple(refs), stage))
+        return tuple(program)
+
+    def __getattr__(self, name):
+        names = self.__dict__.get("names", {})
+        if name in names:
+            return self.values[names[name]]
+        raise AttributeError(name)
+
+    def process(self, source0, roi=None):
+        """Runs the pipeline and sets all outputs to new values."""
+        if roi is not None:
+            raise ValueError("GripPipeline does not support processing windows")
+        # One read, so a concurrent set_params applies from the next frame
+        program = self.program
+        values = [source0]
+        timer = self.stage_timer
+        if timer:
+            t = time.perf_counter()
+        for run, refs, stage in program:
+            values.append(run(*[values[i] for i in refs]))
+            if timer:
+                t = timer.lap(stage, t)
+        self.values = values
+
+    def set_params(self, changes):
+        """Atomically change step parameters.
+        Args:
+            changes: {(step index, socket): value}.
+        """
+        steps = [(name, dict(params), inputs) for name, params, inputs in self.steps]
+        for (index, socket), value in changes.items():
+            steps[index][1][socket] = value
+        program = self.compile(steps)
+        self.steps = steps
+        self.program = program
+
+    def find_step(self, name):
+        return [step[0] for step in self.steps].index(name)
+
+    def set_resize(self, width, height):
+        """Changes the Resize Image size, rescaling the filter's pixel limits
+        so the same targets still pass, like VisionPipeline.set_resize."""
+        resize = self.find_step("Resize Image")
+        params = self.steps[resize][1]
+        scale = width / params[1]
+        changes = {(resize, 1): float(width), (resize, 2): float(height)}
+        if "Filter Contours" in [step[0] for step in self.steps]:
+            filter = self.find_step("Filter Contours")
+            params = self.steps[filter][1]
+            changes[(filter, 1)] = params[1] * scale * scale
+            for socket in (2, 3, 4, 5, 6):
+                changes[(filter, socket)] = params[socket] * scale
+        self.set_params(changes)
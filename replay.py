@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+# Plays videos, image directories and match recordings through the cscore
+# CvSink grabFrame contract, so the vision code can run without a camera.
+#
+#   python replay.py match1.avi                    # through ThreadedInput/ThreadedVision
+#   python replay.py --paced /home/pi/recordings/20190302-101500-612/
+#   python replay.py --sync --json results.jsonl frames/
+#   python frc2554_vision_final.py --replay match1.avi
+#
+# Replay is deterministic: the same footage always gives the same frames
+# with the same timestamps. --sync processes every frame in order, so the
+# results are too.
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def maskToFrame(mask):
+    """A recorded threshold mask as a BGR frame the pipeline thresholds back to the same blobs."""
+    frame = np.zeros(mask.shape + (3,), dtype=np.uint8)
+    # The resized mask has grey edges; any of them was part of a blob
+    frame[:, :, 1] = np.where(mask > 0, 255, 0)
+    return frame
+
+
+def readRecording(directory):
+    """Yield (microseconds since the first frame, frame, recorded result) from a MatchRecorder session."""
+    with open(os.path.join(directory, "recording.json")) as f:
+        info = json.load(f)
+    first = None
+    for path in sorted(glob.glob(os.path.join(directory, "chunk_*.npy"))):
+        images = np.load(path, mmap_mode="r")
+        with open(path[:-len(".npy")] + ".jsonl") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        # Frames past the last metadata line were never completely written
+        for image, record in zip(images, records):
+            if first is None:
+                first = record["timestamp"]
+            if info.get("packed"):
+                image = np.unpackbits(image, axis=-1)[..., :record["width"]]
+            frame = maskToFrame(image) if info["mode"] == "mask" else image
+            yield record["timestamp"] - first, frame, record["result"]
+
+
+def readSource(path, fps):
+    """Yield (microseconds since the first frame, frame, recorded result or None) from one path."""
+    period = 1e6 / fps
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, "recording.json")):
+        yield from readRecording(path)
+    elif os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS))
+        index = 0
+        for name in names:
+            frame = cv2.imread(os.path.join(path, name))
+            if frame is not None:
+                yield int(index * period), frame, None
+                index += 1
+    elif path.lower().endswith(IMAGE_EXTENSIONS):
+        frame = cv2.imread(path)
+        if frame is not None:
+            yield 0, frame, None
+    else:
+        cap = cv2.VideoCapture(path)
+        videoPeriod = 1e6 / (cap.get(cv2.CAP_PROP_FPS) or fps)
+        index = 0
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield int(index * videoPeriod), frame, None
+            index += 1
+        cap.release()
+
+
+def iterReplay(paths, fps=30.0, loop=False):
+    """Yield (timestamp, frame, recorded result) over all paths in order.
+
+    Timestamps are microseconds like cscore's, start at one frame period and
+    always increase, across paths and loops.
+    """
+    period = int(1e6 / fps)
+    base = period
+    last = 0
+    while True:
+        count = 0
+        for path in paths:
+            for relative, frame, result in readSource(path, fps):
+                last = max(base + relative, last + 1)
+                count += 1
+                yield last, frame, result
+            base = last + period
+        if not loop or count == 0:
+            return
+
+
+class ReplaySink:
+    """Stands in for a cscore CvSink.
+
+    grabFrame(img) fills img with the next frame (resized if the footage is
+    another size) and returns (timestamp in microseconds, img). Unpaced,
+    frames come as fast as they are asked for; paced, each one is held back
+    until its timestamp, counted from the first frame. At the end it returns
+    timestamp 0 with getError() set, the way CvSink reports a lost camera.
+    """
+
+    def __init__(self, paths, paced=False, loop=False, fps=30.0):
+        self.frames = iterReplay(paths, fps, loop)
+        self.paced = paced
+        self.error = ""
+        self.finished = False
+        self.count = 0
+        # Result recorded with the last frame, if it came from a recording
+        self.recorded = None
+        self.start = None
+        self.first = None
+
+    def grabFrame(self, img):
+        try:
+            timestamp, frame, self.recorded = next(self.frames)
+        except StopIteration:
+            self.error = "end of replay"
+            self.finished = True
+            # CvSink waits before timing out, so callers don't spin
+            time.sleep(0.1)
+            return 0, img
+
+        if self.paced:
+            if self.start is None:
+                self.start = time.monotonic()
+                self.first = timestamp
+            time.sleep(max(self.start + (timestamp - self.first) / 1e6 - time.monotonic(), 0))
+
+        if frame.shape == img.shape:
+            np.copyto(img, frame)
+        else:
+            cv2.resize(frame, (img.shape[1], img.shape[0]), dst=img, interpolation=cv2.INTER_AREA)
+        self.count += 1
+        return timestamp, img
+
+    def getError(self):
+        return self.error
+
+
+def replaySync(sink, resultsFile):
+    """Process every frame in order on this thread. Returns (frames, targets)."""
+    from frc2554_vision_final import PoseEstimator, findTarget, image_height, image_width, makePipeline
+
+    grip = makePipeline()
+    pose = PoseEstimator()
+    img = np.zeros((image_height, image_width, 3), dtype=np.uint8)
+    frames = targets = 0
+    while True:
+        timestamp, img = sink.grabFrame(img)
+        if timestamp == 0:
+            return frames, targets
+        grip.process(img)
+        targetContours, shuffleboard_data = findTarget(grip.filter_contours_output, timestamp / 1e6)
+        pose.update(targetContours, shuffleboard_data)
+        frames += 1
+        targets += shuffleboard_data["target_exists"]
+        if resultsFile:
+            resultsFile.write(json.dumps({"timestamp": timestamp, "result": shuffleboard_data}, default=float))
+            resultsFile.write("\n")
+
+
+def replayThreaded(sink, resultsFile):
+    """Run ThreadedInput and ThreadedVision the way the robot does. Returns (results, targets)."""
+    from frc2554_vision_final import ThreadedInput, ThreadedVision
+
+    imgetter = ThreadedInput(sink).start()
+    vis = ThreadedVision(imgetter).start()
+    results = targets = 0
+    lastSeq = 0
+    while not (sink.finished and vis.seq == imgetter.seq):
+        seq, output = vis.waitForResult(lastSeq, timeout=0.5)
+        if seq == lastSeq:
+            continue
+        lastSeq = seq
+        shuffleboard_data = output[1]
+        results += 1
+        targets += shuffleboard_data["target_exists"]
+        if resultsFile:
+            resultsFile.write(json.dumps({"seq": seq, "result": shuffleboard_data}, default=float))
+            resultsFile.write("\n")
+    vis.stop()
+    imgetter.close()
+    print("dropped {} frames".format(vis.dropped))
+    return results, targets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay footage through the vision code")
+    parser.add_argument("paths", nargs="+", help="videos, image dirs or match recordings")
+    parser.add_argument("--paced", action="store_true", help="play at the recorded rate")
+    parser.add_argument("--loop", action="store_true")
+    parser.add_argument("--fps", type=float, default=30.0, help="rate of image directories")
+    parser.add_argument("--sync", action="store_true", help="process every frame in order, no threads")
+    parser.add_argument("--json", help="write one result per line here")
+    args = parser.parse_args()
+
+    sink = ReplaySink(args.paths, paced=args.paced, loop=args.loop, fps=args.fps)
+    output = open(args.json, "w") if args.json else None
+    start = time.perf_counter()
+    if args.sync:
+        results, targets = replaySync(sink, output)
+    else:
+        results, targets = replayThreaded(sink, output)
+    elapsed = time.perf_counter() - start
+    if output:
+        output.close()
+
+    print("{} frames read, {} results, {} with a target".format(sink.count, results, targets))
+    print("{:.1f} results/s".format(results / elapsed if elapsed else 0.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+# Renders 2019 retro-reflective tape pairs into 640x480 BGR frames with exact
+# ground truth, and sweeps VisionPipeline variants for accuracy against fps.
+#
+#   python synthetic_targets.py --frames 100000 --variant default --variant resize_first
+#   python synthetic_targets.py --frames 20 --save-dir scenes/
+#
+# Frames are generated lazily from (seed, index), so any corpus size can be
+# swept without writing it to disk, and any frame can be regenerated.
+
+import argparse
+import json
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+from frc2554_vision_final import (
+    CENTER_WIDTH_PIXEL,
+    DEG_PER_PIXEL,
+    HFOV,
+    IMAGE_WIDTH,
+    TAPES,
+    PoseEstimator,
+    VisionPipeline,
+    drawTarget,
+    findTarget,
+    idealIntrinsics,
+    image_height,
+    image_width,
+    makePipeline,
+)
+
+FOCAL_LENGTH = (image_width / 2) / math.tan(math.radians(HFOV / 2))
+
+# (low, high) for every scene parameter; distance and height in inches,
+# angles in degrees, blur in pixels
+DEFAULT_RANGES = {
+    "distance": (24.0, 200.0),
+    "yaw": (-25.0, 25.0),
+    "skew": (-40.0, 40.0),
+    "height": (-10.0, 10.0),
+    "exposure": (0.6, 1.4),
+    "noise": (0.0, 12.0),
+    "blur": (0.0, 9.0),
+    "distractors": (0.0, 3.0),
+}
+
+
+def projectTapes(distance, yaw, skew, height):
+    """Project both tapes into the 640x480 frame; returns two float (4, 2) arrays or None."""
+    yaw_r = math.radians(yaw)
+    turn = math.radians(yaw + skew)
+    center = np.array([distance * math.sin(yaw_r), height, distance * math.cos(yaw_r)])
+
+    polygons = []
+    for tape in TAPES:
+        u, v = tape[:, 0], tape[:, 1]
+        # Target plane turned about the vertical axis; camera y points down
+        points = np.stack([u * math.cos(turn), -v, -u * math.sin(turn)], axis=1) + center
+        if np.any(points[:, 2] <= 1.0):
+            return None
+        x = FOCAL_LENGTH * points[:, 0] / points[:, 2] + (image_width - 1) / 2
+        y = FOCAL_LENGTH * points[:, 1] / points[:, 2] + (image_height - 1) / 2
+        polygons.append(np.stack([x, y], axis=1))
+    return polygons
+
+
+def polygonCentroid(polygon):
+    M = cv2.moments(polygon.astype(np.float32))
+    return M["m10"] / M["m00"], M["m01"] / M["m00"], M["m00"]
+
+
+def groundTruth(polygons, distance, yaw):
+    """The result angleToTarget should publish for these tapes."""
+    truth = {
+        "target_exists": False,
+        "center1": None,
+        "center2": None,
+        "midpoint": None,
+        "yaw_angle": None,
+        "true_yaw": yaw,
+        "distance": distance,
+    }
+    if polygons is None:
+        return truth
+    for polygon in polygons:
+        if polygon[:, 0].min() < 0 or polygon[:, 0].max() > image_width - 1:
+            return truth
+        if polygon[:, 1].min() < 0 or polygon[:, 1].max() > image_height - 1:
+            return truth
+
+    # angleToTarget works at IMAGE_WIDTH and calls the bigger tape center1
+    scale = IMAGE_WIDTH / image_width
+    centers = sorted((polygonCentroid(p * scale) for p in polygons), key=lambda c: -abs(c[2]))
+    center1 = (int(centers[0][0]), int(centers[0][1]))
+    center2 = (int(centers[1][0]), int(centers[1][1]))
+    midpoint = (int((center1[0] + center2[0]) / 2), int((center1[1] + center2[1]) / 2))
+    truth.update(
+        target_exists=True,
+        center1=center1,
+        center2=center2,
+        midpoint=midpoint,
+        yaw_angle=(midpoint[0] - CENTER_WIDTH_PIXEL) * DEG_PER_PIXEL,
+    )
+    return truth
+
+
+def renderScene(distance, yaw, skew, height=0.0, exposure=1.0, noise=0.0, blur=0.0,
+                distractors=0.0, rng=None):
+    """Render one frame. Returns (BGR frame, ground truth dict)."""
+    if rng is None:
+        rng = np.random.RandomState(0)
+
+    frame = np.empty((image_height, image_width, 3), dtype=np.float32)
+    frame[:] = rng.uniform(10, 40, size=3)
+    # Field lighting falls off toward the bottom of the frame
+    frame *= np.linspace(1.2, 0.7, image_height, dtype=np.float32)[:, None, None]
+
+    for _ in range(rng.poisson(distractors)):
+        color = rng.uniform(120, 255, size=3)
+        if rng.rand() < 0.3:
+            # Green-ish lights are the ones that fool the threshold
+            color[1] = 255
+        center = (int(rng.uniform(0, image_width)), int(rng.uniform(0, image_height)))
+        if rng.rand() < 0.5:
+            cv2.circle(frame, center, int(rng.uniform(2, 25)), color.tolist(), -1, cv2.LINE_AA)
+        else:
+            size = rng.uniform(3, 40, size=2)
+            box = (center, (float(size[0]), float(size[1])), float(rng.uniform(0, 180)))
+            cv2.fillPoly(frame, [np.int32(cv2.boxPoints(box))], color.tolist(), cv2.LINE_AA)
+
+    polygons = projectTapes(distance, yaw, skew, height)
+    if polygons is not None:
+        tape_color = (np.array([90.0, 255.0, 80.0]) * exposure).tolist()
+        for polygon in polygons:
+            # 4 fractional bits keep the subpixel corners
+            cv2.fillPoly(frame, [np.int32(polygon * 16)], tape_color, cv2.LINE_AA, shift=4)
+
+    if blur >= 2:
+        length = int(blur)
+        kernel = np.zeros((length, length), dtype=np.float32)
+        kernel[length // 2, :] = 1.0 / length
+        angle = rng.uniform(0, 180)
+        rotation = cv2.getRotationMatrix2D(((length - 1) / 2, (length - 1) / 2), angle, 1.0)
+        kernel = cv2.warpAffine(kernel, rotation, (length, length))
+        kernel /= max(kernel.sum(), 1e-6)
+        frame = cv2.filter2D(frame, -1, kernel)
+
+    if noise > 0:
+        frame += rng.normal(0, noise, size=frame.shape).astype(np.float32)
+
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+    return frame, groundTruth(polygons, distance, yaw)
+
+
+def sampleParams(rng, ranges=DEFAULT_RANGES):
+    return {name: float(rng.uniform(low, high)) for name, (low, high) in ranges.items()}
+
+
+def generateScenes(count, seed=0, ranges=DEFAULT_RANGES):
+    """Lazily yield (index, params, frame, truth); frame i depends only on (seed, i)."""
+    for index in range(count):
+        rng = np.random.RandomState((seed * 1000003 + index) % (2 ** 32))
+        params = sampleParams(rng, ranges)
+        frame, truth = renderScene(rng=rng, **params)
+        yield index, params, frame, truth
+
+
+# VisionPipeline arguments; "default" is the pipeline the robot runs
+# (makePipeline), "pasted" the VisionPipeline pasted into the script
+VARIANTS = {
+    "default": None,
+    "pasted": {},
+    "resize_first": {"resize_first": True},
+    "components": {"backend": "components"},
+    "resize_first_components": {"resize_first": True, "backend": "components"},
+}
+
+
+def makeVariant(name):
+    if VARIANTS[name] is None:
+        return makePipeline()
+    return VisionPipeline(**VARIANTS[name])
+
+
+def scoreVariants(variants, count, seed, ranges=DEFAULT_RANGES):
+    pipelines = {name: makeVariant(name) for name in variants}
+    # Scenes are rendered with an ideal pinhole camera, not the robot's calibration
+    poses = {name: PoseEstimator(idealIntrinsics()) for name in variants}
+    scores = {
+        name: {"hits": 0, "misses": 0, "false_positives": 0, "true_negatives": 0,
+               "midpoint_error": [], "yaw_error": [], "distance_error": [], "seconds": 0.0}
+        for name in variants
+    }
+
+    for index, params, frame, truth in generateScenes(count, seed, ranges):
+        for name, grip in pipelines.items():
+            score = scores[name]
+            start = time.perf_counter()
+            grip.process(frame)
+            small = cv2.resize(frame, (320, 240), interpolation=cv2.INTER_CUBIC)
+            targetContours, result = findTarget(grip.filter_contours_output)
+            drawTarget(small, targetContours, result)
+            poses[name].update(targetContours, result)
+            score["seconds"] += time.perf_counter() - start
+
+            if truth["target_exists"] and result["target_exists"]:
+                score["hits"] += 1
+                dx = result["midpoint"][0] - truth["midpoint"][0]
+                dy = result["midpoint"][1] - truth["midpoint"][1]
+                score["midpoint_error"].append(math.hypot(dx, dy))
+                score["yaw_error"].append(abs(result["yaw_angle"] - truth["yaw_angle"]))
+                if result["distance"] > 0:
+                    score["distance_error"].append(abs(result["distance"] - truth["distance"]) / truth["distance"])
+            elif truth["target_exists"]:
+                score["misses"] += 1
+            elif result["target_exists"]:
+                score["false_positives"] += 1
+            else:
+                score["true_negatives"] += 1
+
+    report = {}
+    for name, score in scores.items():
+        visible = score["hits"] + score["misses"]
+        report[name] = {
+            "fps": count / score["seconds"] if score["seconds"] else 0.0,
+            "detection_rate": score["hits"] / visible if visible else 0.0,
+            "false_positives": score["false_positives"],
+            "midpoint_error_px": float(np.mean(score["midpoint_error"])) if score["hits"] else None,
+            "yaw_error_deg_p95": float(np.percentile(score["yaw_error"], 95)) if score["hits"] else None,
+            "distance_error_p95": (
+                float(np.percentile(score["distance_error"], 95)) if score["distance_error"] else None
+            ),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic vision target scenes")
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--variant", action="append", choices=sorted(VARIANTS))
+    parser.add_argument("--save-dir", help="write frames + truth JSON instead of scoring")
+    parser.add_argument("--json", help="write the score report here")
+    args = parser.parse_args()
+
+    if args.save_dir:
+        os.makedirs(args.save_dir, exist_ok=True)
+        for index, params, frame, truth in generateScenes(args.frames, args.seed):
+            base = os.path.join(args.save_dir, "{:06d}".format(index))
+            cv2.imwrite(base + ".png", frame)
+            with open(base + ".json", "w") as f:
+                json.dump({"params": params, "truth": truth}, f)
+        return
+
+    report = scoreVariants(args.variant or ["default"], args.frames, args.seed)
+    for name, result in report.items():
+        print(
+            "{:<26} {:7.1f} fps  detected {:6.1%}  false+ {:5d}  midpoint err {}  yaw err p95 {}  distance err p95 {}".format(
+                name,
+                result["fps"],
+                result["detection_rate"],
+                result["false_positives"],
+                "-" if result["midpoint_error_px"] is None else "{:.2f} px".format(result["midpoint_error_px"]),
+                "-" if result["yaw_error_deg_p95"] is None else "{:.2f} deg".format(result["yaw_error_deg_p95"]),
+                "-" if result["distance_error_p95"] is None else "{:.1%}".format(result["distance_error_p95"]),
+            )
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()